@@ -0,0 +1,680 @@
+"""
+Offline benchmark for the Auto-Backup Master Bot.
+
+Starts local stand-ins for the Telegram Bot API and the GitHub contents API,
+boots master_bot against them and replays a synthetic update stream through
+/webhook/<bot_token>. No real credentials or network access are needed.
+
+    python benchmark.py --updates 2000 --concurrency 16
+    python benchmark.py --telegram-latency 0.05 --store-429-rate 0.1 --output bench.json
+    python benchmark.py --store s3
+    python benchmark.py --compare bench.json
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+from urllib.parse import urlparse, unquote, parse_qsl
+
+import requests
+
+BENCH_BOT_TOKEN = "100000:BENCHMARK_TOKEN"
+WRITE_OPS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Synthetic command mix: (text, weight). Each produces exactly one reply.
+DEFAULT_MIX = [
+    ('/start', 3),
+    ('/help', 2),
+    ('/mystats', 3),
+    ('/stats', 1),
+    ('hello', 1),
+]
+
+# ==================== FAKE SERVERS ====================
+
+class FakeServer:
+    """Threaded local HTTP server with injectable latency and 429s"""
+
+    def __init__(self, latency=0.0, rate_limit=0.0, seed=None):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def should_throttle(self):
+        """Apply latency and decide whether this call gets a 429"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.random_lock:
+            throttle = self.rate_limit > 0 and self.random.random() < self.rate_limit
+        with self.stats_lock:
+            self.requests += 1
+            if throttle:
+                self.throttled += 1
+        return throttle
+
+    def handle(self, handler, method):
+        raise NotImplementedError
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def read_json(self):
+                body = self.read_body()
+                if not body:
+                    return {}
+                try:
+                    return json.loads(body)
+                except ValueError:
+                    return {}
+
+            def send_json(self, status, payload):
+                self.send_bytes(status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+            def send_bytes(self, status, body, content_type='application/octet-stream', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                server.handle(self, 'GET')
+
+            def do_POST(self):
+                server.handle(self, 'POST')
+
+            def do_PUT(self):
+                server.handle(self, 'PUT')
+
+            def do_PATCH(self):
+                server.handle(self, 'PATCH')
+
+            def do_HEAD(self):
+                server.handle(self, 'HEAD')
+
+            def do_DELETE(self):
+                server.handle(self, 'DELETE')
+
+        return Handler
+
+class FakeTelegram(FakeServer):
+    """Telegram Bot API stand-in; reports every sendMessage to waiters"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.waiters = {}
+        self.waiters_lock = threading.Lock()
+        self.webhooks = {}
+
+    def waiter(self, chat_id):
+        with self.waiters_lock:
+            return self.waiters.setdefault(chat_id, Queue())
+
+    def handle(self, handler, method):
+        parts = urlparse(handler.path).path.strip('/').split('/')
+        body = handler.read_json()
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            handler.send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        token, api_method = parts[0][3:], parts[1]
+
+        throttled = self.should_throttle()
+        if api_method == 'sendMessage':
+            self.waiter(body.get('chat_id')).put((time.perf_counter(), not throttled))
+        if throttled:
+            handler.send_json(429, {
+                'ok': False, 'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1}
+            })
+            return
+
+        if api_method == 'getMe':
+            bot_id = token.split(':')[0]
+            result = {'id': int(bot_id) if bot_id.isdigit() else 1, 'is_bot': True,
+                      'first_name': 'Bench', 'username': f"bench_{bot_id}_bot"}
+        elif api_method == 'setWebhook':
+            self.webhooks[token] = body.get('url')
+            result = True
+        elif api_method == 'getWebhookInfo':
+            result = {'url': self.webhooks.get(token, ''), 'pending_update_count': 0}
+        elif api_method == 'sendMessage':
+            result = {'message_id': 1, 'chat': {'id': body.get('chat_id')}, 'text': body.get('text')}
+        else:
+            result = True
+        handler.send_json(200, {'ok': True, 'result': result})
+
+class FakeGitHub(FakeServer):
+    """In-memory GitHub stand-in: contents API plus the git data API
+    (blobs, trees, commits, refs) used for chunked uploads"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.files_lock = threading.Lock()
+        self.bytes_uploaded = 0
+        self.blobs = {}
+        self.trees = {'tree0': {}}
+        self.commits = {'commit0': ('tree0', None)}
+        self.head = 'commit0'
+
+    @property
+    def files(self):
+        """Current branch tree: path -> blob sha"""
+        return self.trees[self.commits[self.head][0]]
+
+    def _store_blob(self, content):
+        sha = hashlib.sha1(content).hexdigest()
+        self.blobs[sha] = content
+        self.bytes_uploaded += len(content)
+        return sha
+
+    def _commit(self, tree, parent):
+        tree_sha = hashlib.sha1(json.dumps(sorted(tree.items())).encode()).hexdigest()
+        self.trees[tree_sha] = tree
+        commit_sha = hashlib.sha1(f"{tree_sha}:{parent}:{len(self.commits)}".encode()).hexdigest()
+        self.commits[commit_sha] = (tree_sha, parent)
+        return commit_sha
+
+    def handle(self, handler, method):
+        path = unquote(urlparse(handler.path).path)
+        body = handler.read_json() if method in ('PUT', 'POST', 'PATCH') else {}
+        parts = path.strip('/').split('/', 4)
+        if len(parts) < 4 or parts[0] != 'repos':
+            handler.send_json(404, {'message': 'Not Found'})
+            return
+
+        if self.should_throttle():
+            handler.send_json(429, {'message': 'API rate limit exceeded'})
+            return
+
+        raw = 'raw' in handler.headers.get('Accept', '')
+        with self.files_lock:
+            if parts[3] == 'contents':
+                self._handle_contents(handler, method, parts[4] if len(parts) > 4 else '', body, raw)
+            elif parts[3] == 'git' and len(parts) > 4:
+                self._handle_git(handler, method, parts[4], body, raw)
+            else:
+                handler.send_json(404, {'message': 'Not Found'})
+
+    def _handle_contents(self, handler, method, filepath, body, raw):
+        files = self.files
+        if method == 'PUT':
+            existed = filepath in files
+            if existed and body.get('sha') != files[filepath]:
+                handler.send_json(422, {'message': '"sha" wasn\'t supplied.'})
+                return
+            sha = self._store_blob(base64.b64decode(body.get('content', '')))
+            self.head = self._commit(dict(files, **{filepath: sha}), self.head)
+            handler.send_json(200 if existed else 201, {'content': {'path': filepath, 'sha': sha}})
+            return
+
+        if filepath in files:
+            sha = files[filepath]
+            content = self.blobs[sha]
+            if raw:
+                handler.send_bytes(200, content)
+            else:
+                handler.send_json(200, {
+                    'name': filepath.rsplit('/', 1)[-1], 'path': filepath, 'sha': sha,
+                    'size': len(content), 'content': base64.b64encode(content).decode('ascii')
+                })
+            return
+
+        prefix = filepath.rstrip('/') + '/'
+        entries = {}
+        for p, sha in files.items():
+            if not p.startswith(prefix):
+                continue
+            name, _, rest = p[len(prefix):].partition('/')
+            if rest:
+                entries.setdefault(name, {'name': name, 'path': prefix + name, 'type': 'dir'})
+            else:
+                entries[name] = {'name': name, 'path': p, 'sha': sha, 'size': len(self.blobs[sha]), 'type': 'file'}
+        if entries:
+            handler.send_json(200, list(entries.values()))
+        else:
+            handler.send_json(404, {'message': 'Not Found'})
+
+    def _handle_git(self, handler, method, rest, body, raw):
+        kind, _, ident = rest.partition('/')
+        if kind == 'blobs' and method == 'POST':
+            handler.send_json(201, {'sha': self._store_blob(base64.b64decode(body.get('content', '')))})
+        elif kind == 'blobs' and ident in self.blobs:
+            content = self.blobs[ident]
+            if raw:
+                handler.send_bytes(200, content)
+            else:
+                handler.send_json(200, {'sha': ident, 'encoding': 'base64',
+                                        'content': base64.b64encode(content).decode('ascii')})
+        elif kind == 'ref' and ident.startswith('heads/'):
+            handler.send_json(200, {'ref': f"refs/{ident}", 'object': {'sha': self.head, 'type': 'commit'}})
+        elif kind == 'commits' and method == 'GET' and ident in self.commits:
+            handler.send_json(200, {'sha': ident, 'tree': {'sha': self.commits[ident][0]}})
+        elif kind == 'trees' and method == 'GET':
+            # "<branch>:<dir>" listing of direct children
+            prefix = ident.partition(':')[2].strip('/') + '/'
+            entries = {}
+            for p, sha in self.files.items():
+                if p.startswith(prefix):
+                    name, _, rest = p[len(prefix):].partition('/')
+                    entries[name] = {'path': name, 'type': 'tree' if rest else 'blob',
+                                     'sha': None if rest else sha}
+            if entries:
+                handler.send_json(200, {'tree': list(entries.values()), 'truncated': False})
+            else:
+                handler.send_json(404, {'message': 'Not Found'})
+        elif kind == 'trees' and method == 'POST':
+            tree = dict(self.trees.get(body.get('base_tree'), {}))
+            for entry in body.get('tree', []):
+                if entry['sha'] is None:
+                    # Deletes a file or a whole directory
+                    for p in [p for p in tree if p == entry['path'] or p.startswith(entry['path'] + '/')]:
+                        del tree[p]
+                else:
+                    tree[entry['path']] = entry['sha']
+            tree_sha = hashlib.sha1(json.dumps(sorted(tree.items())).encode()).hexdigest()
+            self.trees[tree_sha] = tree
+            handler.send_json(201, {'sha': tree_sha})
+        elif kind == 'commits' and method == 'POST':
+            commit_sha = hashlib.sha1(f"{body['tree']}:{body['parents']}:{len(self.commits)}".encode()).hexdigest()
+            self.commits[commit_sha] = (body['tree'], body['parents'][0] if body['parents'] else None)
+            handler.send_json(201, {'sha': commit_sha})
+        elif kind == 'refs' and method == 'PATCH':
+            new = body.get('sha')
+            if new not in self.commits or self.commits[new][1] != self.head:
+                handler.send_json(422, {'message': 'Update is not a fast forward'})
+                return
+            self.head = new
+            handler.send_json(200, {'ref': f"refs/{ident}", 'object': {'sha': new, 'type': 'commit'}})
+        else:
+            handler.send_json(404, {'message': 'Not Found'})
+
+class FakeS3(FakeServer):
+    """In-memory S3 stand-in (path-style): objects, conditional PUT, ranged
+    GET, listing, multipart upload. Signatures are not verified."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.objects = {}
+        self.uploads = {}
+        self.objects_lock = threading.Lock()
+        self.bytes_uploaded = 0
+
+    def handle(self, handler, method):
+        parsed = urlparse(handler.path)
+        query = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        bucket, _, key = unquote(parsed.path).lstrip('/').partition('/')
+        body = handler.read_body()
+
+        if not handler.headers.get('Authorization', '').startswith('AWS4-HMAC-SHA256 '):
+            handler.send_bytes(403, b'<Error><Code>AccessDenied</Code></Error>', 'application/xml')
+            return
+        if self.should_throttle():
+            handler.send_bytes(503, b'<Error><Code>SlowDown</Code></Error>', 'application/xml')
+            return
+
+        with self.objects_lock:
+            if not key and method == 'GET':
+                self._list(handler, bucket, query)
+            elif method == 'POST' and 'uploads' in query:
+                upload_id = uuid.uuid4().hex
+                self.uploads[upload_id] = {}
+                handler.send_bytes(200, f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId>"
+                                        f"</InitiateMultipartUploadResult>".encode(), 'application/xml')
+            elif method == 'PUT' and 'uploadId' in query:
+                parts = self.uploads.get(query['uploadId'])
+                if parts is None:
+                    handler.send_bytes(404, b'<Error><Code>NoSuchUpload</Code></Error>', 'application/xml')
+                    return
+                parts[int(query['partNumber'])] = body
+                self.bytes_uploaded += len(body)
+                handler.send_response(200)
+                handler.send_header('ETag', f'"{hashlib.md5(body).hexdigest()}"')
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+            elif method == 'POST' and 'uploadId' in query:
+                parts = self.uploads.pop(query['uploadId'], None)
+                if parts is None:
+                    handler.send_bytes(404, b'<Error><Code>NoSuchUpload</Code></Error>', 'application/xml')
+                    return
+                self.objects[(bucket, key)] = b''.join(parts[n] for n in sorted(parts))
+                handler.send_bytes(200, b'<CompleteMultipartUploadResult/>', 'application/xml')
+            elif method == 'DELETE' and 'uploadId' in query:
+                self.uploads.pop(query['uploadId'], None)
+                handler.send_bytes(204, b'')
+            elif method == 'DELETE':
+                self.objects.pop((bucket, key), None)
+                handler.send_bytes(204, b'')
+            elif method == 'PUT':
+                current = self.objects.get((bucket, key))
+                if_match = handler.headers.get('If-Match')
+                if ((handler.headers.get('If-None-Match') == '*' and current is not None) or
+                        (if_match and (current is None or if_match != self.etag(current)))):
+                    handler.send_bytes(412, b'<Error><Code>PreconditionFailed</Code></Error>', 'application/xml')
+                    return
+                self.objects[(bucket, key)] = body
+                self.bytes_uploaded += len(body)
+                handler.send_bytes(200, b'')
+            elif (bucket, key) not in self.objects:
+                handler.send_bytes(404, b'' if method == 'HEAD' else b'<Error><Code>NoSuchKey</Code></Error>', 'application/xml')
+            elif method == 'HEAD':
+                handler.send_response(200)
+                handler.send_header('Content-Length', str(len(self.objects[(bucket, key)])))
+                handler.end_headers()
+            else:
+                content = self.objects[(bucket, key)]
+                byte_range = handler.headers.get('Range')
+                if byte_range:
+                    start, _, end = byte_range.split('=', 1)[1].partition('-')
+                    handler.send_bytes(206, content[int(start):int(end) + 1])
+                else:
+                    handler.send_bytes(200, content, headers={'ETag': self.etag(content)})
+
+    @staticmethod
+    def etag(content):
+        return f'"{hashlib.md5(content).hexdigest()}"'
+
+    def _list(self, handler, bucket, query):
+        prefix = query.get('prefix', '')
+        keys, prefixes = [], set()
+        for b, key in sorted(self.objects):
+            if b != bucket or not key.startswith(prefix):
+                continue
+            head, sep, _ = key[len(prefix):].partition('/')
+            if sep and query.get('delimiter'):
+                prefixes.add(prefix + head + '/')
+            else:
+                keys.append(key)
+        body = f"<ListBucketResult><Prefix>{prefix}</Prefix><IsTruncated>false</IsTruncated>"
+        body += "".join(f"<Contents><Key>{k}</Key></Contents>" for k in keys)
+        body += "".join(f"<CommonPrefixes><Prefix>{p}</Prefix></CommonPrefixes>" for p in sorted(prefixes))
+        handler.send_bytes(200, (body + "</ListBucketResult>").encode(), 'application/xml')
+
+# ==================== BENCHMARK ====================
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def db_write_count(metrics):
+    """Total write statements recorded by master_bot's metrics"""
+    with metrics.lock:
+        return sum(
+            hist['count'] for (name, labels), hist in metrics.histograms.items()
+            if name == 'sqlite_statement_seconds' and dict(labels).get('op', '').split('_')[0] in WRITE_OPS
+        )
+
+def store_bytes(store):
+    """Bytes written to the backup store so far"""
+    if isinstance(store, str):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(store) for name in names
+        )
+    return store.bytes_uploaded
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def boot_master_bot(telegram, store_kind, store, workdir):
+    """Import master_bot against the fake servers and serve it locally"""
+    from werkzeug.serving import make_server
+
+    os.environ.update({
+        'BOT_TOKEN': BENCH_BOT_TOKEN,
+        'TELEGRAM_API_BASE': telegram.url,
+        'ADMIN_TOKEN': 'bench-admin-token',
+        'BACKUP_STORE': store_kind,
+    })
+    if store_kind == 'github':
+        os.environ.update({
+            'GITHUB_TOKEN': 'bench-github-token',
+            'GITHUB_REPO_OWNER': 'bench',
+            'GITHUB_REPO_NAME': 'backups',
+            'GITHUB_API_BASE': store.url,
+        })
+    elif store_kind == 's3':
+        os.environ.update({
+            'S3_ENDPOINT': store.url,
+            'S3_BUCKET': 'bench',
+            'S3_ACCESS_KEY_ID': 'bench-access-key',
+            'S3_SECRET_ACCESS_KEY': 'bench-secret-key',
+        })
+    else:
+        os.environ['BACKUP_STORE_DIR'] = store
+    os.environ.pop('RENDER_EXTERNAL_URL', None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+
+    import master_bot
+    master_bot.start_bot()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    httpd = make_server('127.0.0.1', 0, master_bot.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return master_bot, httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+def run_benchmark(args):
+    telegram = FakeTelegram(latency=args.telegram_latency, rate_limit=args.telegram_429_rate, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix='masterbot-bench-')
+    if args.store == 'local':
+        store = os.path.join(workdir, 'store')
+    else:
+        fake = FakeS3 if args.store == 's3' else FakeGitHub
+        store = fake(latency=args.store_latency, rate_limit=args.store_429_rate, seed=args.seed).start()
+    master_bot, httpd, base_url = boot_master_bot(telegram, args.store, store, workdir)
+    webhook_url = f"{base_url}/webhook/{BENCH_BOT_TOKEN}"
+
+    texts = [text for text, _ in args.mix]
+    weights = [weight for _, weight in args.mix]
+
+    latencies = []
+    results = {'ok': 0, 'rate_limited': 0, 'timeouts': 0, 'errors': 0}
+    results_lock = threading.Lock()
+    counter = iter(range(args.updates))
+    counter_lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random((args.seed or 0) * 1000 + worker_id)
+        session = requests.Session()
+        users = [1_000_000 + worker_id * args.users + i for i in range(args.users)]
+        while True:
+            with counter_lock:
+                update_id = next(counter, None)
+            if update_id is None:
+                return
+            user_id = rng.choice(users)
+            text = rng.choices(texts, weights)[0]
+            update = {
+                'update_id': update_id,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f"user{user_id}"},
+                    'text': text
+                }
+            }
+            replies = telegram.waiter(user_id)
+            start = time.perf_counter()
+            try:
+                session.post(webhook_url, json=update, timeout=30)
+                replied_at, delivered = replies.get(timeout=args.timeout)
+            except Empty:
+                outcome = 'timeouts'
+            except Exception:
+                outcome = 'errors'
+            else:
+                outcome = 'ok' if delivered else 'rate_limited'
+            with results_lock:
+                results[outcome] += 1
+                if outcome in ('ok', 'rate_limited'):
+                    latencies.append(replied_at - start)
+
+    writes_before = db_write_count(master_bot.metrics)
+    bytes_before = store_bytes(store)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    # Give trailing background work (backups) a moment to land, then flush
+    # what only ships on an interval (WAL frames, dirty shards) while the
+    # fake store is still up
+    time.sleep(args.drain)
+    master_bot.bot_instance.shutdown()
+    writes = db_write_count(master_bot.metrics) - writes_before
+    backup_bytes = store_bytes(store) - bytes_before
+
+    httpd.shutdown()
+    telegram.stop()
+    if args.store != 'local':
+        store.stop()
+
+    return {
+        'revision': git_revision(),
+        'updates': args.updates,
+        'concurrency': args.concurrency,
+        'elapsed_seconds': round(elapsed, 3),
+        'updates_per_sec': round(args.updates / elapsed, 2) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'db_writes_per_update': round(writes / args.updates, 3) if args.updates else 0.0,
+        'backup_bytes_per_minute': round(backup_bytes / (elapsed / 60.0), 1) if elapsed else 0.0,
+        'outcomes': results,
+        'telegram_requests': telegram.requests,
+        'telegram_429s': telegram.throttled,
+        'store': args.store,
+        'store_requests': getattr(store, 'requests', None),
+        'store_errors': getattr(store, 'throttled', None),
+    }
+
+# ==================== REPORTING ====================
+
+COMPARE_KEYS = [
+    ('updates_per_sec', True),
+    ('latency_p50_ms', False),
+    ('latency_p99_ms', False),
+    ('db_writes_per_update', False),
+    ('backup_bytes_per_minute', False),
+]
+
+def print_report(report, baseline=None):
+    print("=" * 60)
+    print(f"📈 BENCHMARK RESULTS (rev {report.get('revision') or 'unknown'})")
+    print("=" * 60)
+    for key, higher_is_better in COMPARE_KEYS:
+        line = f"{key:<26} {report[key]:>14}"
+        if baseline and baseline.get(key):
+            delta = (report[key] - baseline[key]) / baseline[key] * 100
+            better = delta > 0 if higher_is_better else delta < 0
+            line += f"   {delta:+.1f}% vs {baseline.get('revision') or 'baseline'} {'✅' if better else '⚠️'}"
+        print(line)
+    print(f"{'outcomes':<26} {report['outcomes']}")
+    print(f"{'telegram requests/429s':<26} {report['telegram_requests']}/{report['telegram_429s']}")
+    print(f"{report['store'] + ' requests/errors':<26} {report['store_requests']}/{report['store_errors']}")
+    print("=" * 60)
+
+def parse_mix(value):
+    """Parse a command mix like '/start=3,/help=1'"""
+    mix = []
+    for item in value.split(','):
+        text, _, weight = item.partition('=')
+        mix.append((text, float(weight or 1)))
+    return mix
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Master Bot benchmark")
+    parser.add_argument('--updates', type=int, default=500, help="number of updates to replay")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent senders")
+    parser.add_argument('--users', type=int, default=50, help="distinct users per sender")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="command mix, e.g. '/start=3,/help=1'")
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help="seconds added to each Telegram call")
+    parser.add_argument('--store', choices=('github', 's3', 'local'), default='github', help="backup store backend")
+    parser.add_argument('--store-latency', type=float, default=0.0, help="seconds added to each backup store call")
+    parser.add_argument('--telegram-429-rate', type=float, default=0.0, help="fraction of Telegram calls answered with 429")
+    parser.add_argument('--store-429-rate', type=float, default=0.0,
+                        help="fraction of backup store calls rejected (429 for GitHub, 503 SlowDown for S3)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for each reply")
+    parser.add_argument('--drain', type=float, default=1.0, help="seconds to wait for trailing backups")
+    parser.add_argument('--seed', type=int, default=1, help="random seed")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--compare', help="JSON report from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    report = run_benchmark(args)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.output}")
+    return report
+
+if __name__ == "__main__":
+    main()
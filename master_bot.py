@@ -7,9 +7,10 @@ import sqlite3
 import secrets
 import threading
 import hashlib
+import hmac
 import base64
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context
 from threading import Thread, Lock
 import traceback
 import uuid
@@ -17,6 +18,22 @@ import re
 import subprocess
 import tempfile
 import shutil
+import bisect
+import heapq
+import random
+import queue
+import atexit
+import signal
+import fcntl
+import io
+import csv
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import urlparse, quote
+from xml.etree import ElementTree
 
 print("=" * 60)
 print("🤖 AUTO-BACKUP MASTER BOT")
@@ -31,14 +48,29 @@ class EnvConfig:
     @staticmethod
     def load():
         config = {}
+        config['BACKUP_STORE'] = os.environ.get('BACKUP_STORE', 'github').lower()
+        if config['BACKUP_STORE'] not in ('github', 's3', 'local'):
+            print(f"❌ ERROR: BACKUP_STORE must be github, s3 or local (got {config['BACKUP_STORE']})")
+            sys.exit(1)
         
         # Required variables
         required = {
-            'BOT_TOKEN': 'Telegram Bot Token',
-            'GITHUB_TOKEN': 'GitHub Personal Access Token',
-            'GITHUB_REPO_OWNER': 'GitHub Username',
-            'GITHUB_REPO_NAME': 'GitHub Repository Name'
+            'BOT_TOKEN': 'Telegram Bot Token'
         }
+        if config['BACKUP_STORE'] == 'github':
+            required.update({
+                'GITHUB_TOKEN': 'GitHub Personal Access Token',
+                'GITHUB_REPO_OWNER': 'GitHub Username',
+                'GITHUB_REPO_NAME': 'GitHub Repository Name'
+            })
+        elif config['BACKUP_STORE'] == 's3':
+            required.update({
+                'S3_BUCKET': 'S3 Bucket Name',
+                'S3_ACCESS_KEY_ID': 'S3 Access Key ID',
+                'S3_SECRET_ACCESS_KEY': 'S3 Secret Access Key'
+            })
+        for var in ('GITHUB_TOKEN', 'GITHUB_REPO_OWNER', 'GITHUB_REPO_NAME'):
+            config[var] = os.environ.get(var, '')
         
         # Load required variables
         for var, desc in required.items():
@@ -55,6 +87,66 @@ class EnvConfig:
         config['PORT'] = int(os.environ.get('PORT', 8080))
         config['STAR_PRICE'] = int(os.environ.get('STAR_PRICE', 200))
         config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN', secrets.token_hex(32))
+        config['TELEGRAM_API_BASE'] = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+        config['GITHUB_API_BASE'] = os.environ.get('GITHUB_API_BASE', 'https://api.github.com').rstrip('/')
+        
+        # WAL shipping (continuous replication); interval 0 disables it.
+        # Every shipped segment is a commit on GitHub, which allows about
+        # 500 content-creating requests per hour
+        default_interval = 30 if config['BACKUP_STORE'] == 'github' else 5
+        config['WAL_SHIP_INTERVAL'] = float(os.environ.get('WAL_SHIP_INTERVAL', default_interval))
+        config['WAL_SNAPSHOT_INTERVAL'] = float(os.environ.get('WAL_SNAPSHOT_INTERVAL', 3600))
+        config['WAL_CHECKPOINT_BYTES'] = int(os.environ.get('WAL_CHECKPOINT_BYTES', 4 * 1024 * 1024))
+        config['WAL_PENDING_MAX_BYTES'] = int(os.environ.get('WAL_PENDING_MAX_BYTES', 64 * 1024 * 1024))
+        config['WAL_RETENTION_HOURS'] = float(os.environ.get('WAL_RETENTION_HOURS', 72))
+        config['RESTORE_ATTEMPTS'] = int(os.environ.get('RESTORE_ATTEMPTS', 5))
+        
+        # Backup storage backends
+        config['BACKUP_STORE_DIR'] = os.environ.get('BACKUP_STORE_DIR', 'backups')
+        config['BACKUP_CHUNK_SIZE'] = int(os.environ.get('BACKUP_CHUNK_SIZE', 8 * 1024 * 1024))
+        config['BACKUP_PARALLELISM'] = int(os.environ.get('BACKUP_PARALLELISM', 4))
+        config['S3_REGION'] = os.environ.get('S3_REGION', 'us-east-1')
+        config['S3_ENDPOINT'] = os.environ.get('S3_ENDPOINT', f"https://s3.{config['S3_REGION']}.amazonaws.com").rstrip('/')
+        config['S3_BUCKET'] = os.environ.get('S3_BUCKET', '')
+        config['S3_PREFIX'] = os.environ.get('S3_PREFIX', config['GITHUB_BACKUP_PATH']).strip('/')
+        config['S3_ACCESS_KEY_ID'] = os.environ.get('S3_ACCESS_KEY_ID', '')
+        config['S3_SECRET_ACCESS_KEY'] = os.environ.get('S3_SECRET_ACCESS_KEY', '')
+        
+        # Child-bot provisioning
+        config['PROVISION_WORKERS'] = int(os.environ.get('PROVISION_WORKERS', 2))
+        config['PROVISION_MAX_ATTEMPTS'] = int(os.environ.get('PROVISION_MAX_ATTEMPTS', 4))
+        config['TOKEN_CACHE_TTL'] = float(os.environ.get('TOKEN_CACHE_TTL', 600))
+        
+        # Per-tenant shards for hosted child bots
+        config['SHARD_DIR'] = os.environ.get('SHARD_DIR', 'shards')
+        config['SHARD_CACHE_SIZE'] = int(os.environ.get('SHARD_CACHE_SIZE', 64))
+        config['SHARD_BACKUP_INTERVAL'] = float(os.environ.get('SHARD_BACKUP_INTERVAL', 60))
+        config['SHARD_IDLE_SECONDS'] = float(os.environ.get('SHARD_IDLE_SECONDS', 300))
+        
+        # Bulk export/import
+        config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+        config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 5000))
+        
+        # Maintenance scheduler (intervals in seconds, 0 disables a job)
+        config['SCHEDULER_WORKERS'] = int(os.environ.get('SCHEDULER_WORKERS', 2))
+        config['SCHEDULER_JITTER'] = float(os.environ.get('SCHEDULER_JITTER', 0.1))
+        config['BACKUP_INTERVAL'] = float(os.environ.get('BACKUP_INTERVAL', 600))
+        config['CACHE_PURGE_INTERVAL'] = float(os.environ.get('CACHE_PURGE_INTERVAL', 60))
+        config['ACTIVITY_ROLLUP_INTERVAL'] = float(os.environ.get('ACTIVITY_ROLLUP_INTERVAL', 3600))
+        config['ACTIVITY_RETENTION_DAYS'] = int(os.environ.get('ACTIVITY_RETENTION_DAYS', 30))
+        config['ANALYZE_INTERVAL'] = float(os.environ.get('ANALYZE_INTERVAL', 86400))
+        config['VACUUM_INTERVAL'] = float(os.environ.get('VACUUM_INTERVAL', 7 * 86400))
+        
+        # Hosted-bot webhook health sweeps
+        config['WEBHOOK_SWEEP_INTERVAL'] = float(os.environ.get('WEBHOOK_SWEEP_INTERVAL', 900))
+        config['WEBHOOK_SWEEP_BUDGET'] = float(os.environ.get('WEBHOOK_SWEEP_BUDGET', 300))
+        config['WEBHOOK_SWEEP_CONCURRENCY'] = int(os.environ.get('WEBHOOK_SWEEP_CONCURRENCY', 16))
+        config['WEBHOOK_SWEEP_RATE'] = float(os.environ.get('WEBHOOK_SWEEP_RATE', 25))
+        
+        # Profiling and slow-update traces
+        config['SLOW_UPDATE_SECONDS'] = float(os.environ.get('SLOW_UPDATE_SECONDS', 0.5))
+        config['TRACE_BUFFER_SIZE'] = int(os.environ.get('TRACE_BUFFER_SIZE', 100))
+        config['PROFILE_MAX_SECONDS'] = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
         
         # Auto-detect webhook URL
         render_url = os.environ.get('RENDER_EXTERNAL_URL')
@@ -65,11 +157,13 @@ class EnvConfig:
             config['WEBHOOK_URL'] = f"http://localhost:{config['PORT']}"
             config['MASTER_DOMAIN'] = f"http://localhost:{config['PORT']}"
         
+        print(f"✅ BACKUP_STORE: {config['BACKUP_STORE']}")
         print(f"✅ GITHUB_BACKUP_BRANCH: {config['GITHUB_BACKUP_BRANCH']}")
         print(f"✅ GITHUB_BACKUP_PATH: {config['GITHUB_BACKUP_PATH']}")
         print(f"✅ PORT: {config['PORT']}")
         print(f"✅ STAR_PRICE: {config['STAR_PRICE']}")
         print(f"✅ WEBHOOK_URL: {config['WEBHOOK_URL']}")
+        print(f"✅ WAL_SHIP_INTERVAL: {config['WAL_SHIP_INTERVAL']}")
         print("=" * 60)
         
         return config
@@ -87,6 +181,48 @@ STAR_PRICE = config['STAR_PRICE']
 WEBHOOK_URL = config['WEBHOOK_URL']
 MASTER_DOMAIN = config['MASTER_DOMAIN']
 ADMIN_TOKEN = config['ADMIN_TOKEN']
+TELEGRAM_API_BASE = config['TELEGRAM_API_BASE']
+GITHUB_API_BASE = config['GITHUB_API_BASE']
+WAL_SHIP_INTERVAL = config['WAL_SHIP_INTERVAL']
+WAL_SNAPSHOT_INTERVAL = config['WAL_SNAPSHOT_INTERVAL']
+WAL_CHECKPOINT_BYTES = config['WAL_CHECKPOINT_BYTES']
+WAL_PENDING_MAX_BYTES = config['WAL_PENDING_MAX_BYTES']
+WAL_RETENTION_HOURS = config['WAL_RETENTION_HOURS']
+RESTORE_ATTEMPTS = config['RESTORE_ATTEMPTS']
+BACKUP_STORE = config['BACKUP_STORE']
+BACKUP_STORE_DIR = config['BACKUP_STORE_DIR']
+BACKUP_CHUNK_SIZE = config['BACKUP_CHUNK_SIZE']
+BACKUP_PARALLELISM = config['BACKUP_PARALLELISM']
+S3_ENDPOINT = config['S3_ENDPOINT']
+S3_REGION = config['S3_REGION']
+S3_BUCKET = config['S3_BUCKET']
+S3_PREFIX = config['S3_PREFIX']
+S3_ACCESS_KEY_ID = config['S3_ACCESS_KEY_ID']
+S3_SECRET_ACCESS_KEY = config['S3_SECRET_ACCESS_KEY']
+PROVISION_WORKERS = config['PROVISION_WORKERS']
+PROVISION_MAX_ATTEMPTS = config['PROVISION_MAX_ATTEMPTS']
+TOKEN_CACHE_TTL = config['TOKEN_CACHE_TTL']
+SHARD_DIR = config['SHARD_DIR']
+SHARD_CACHE_SIZE = config['SHARD_CACHE_SIZE']
+SHARD_BACKUP_INTERVAL = config['SHARD_BACKUP_INTERVAL']
+SHARD_IDLE_SECONDS = config['SHARD_IDLE_SECONDS']
+EXPORT_BATCH_SIZE = config['EXPORT_BATCH_SIZE']
+IMPORT_BATCH_SIZE = config['IMPORT_BATCH_SIZE']
+SCHEDULER_WORKERS = config['SCHEDULER_WORKERS']
+SCHEDULER_JITTER = config['SCHEDULER_JITTER']
+BACKUP_INTERVAL = config['BACKUP_INTERVAL']
+CACHE_PURGE_INTERVAL = config['CACHE_PURGE_INTERVAL']
+ACTIVITY_ROLLUP_INTERVAL = config['ACTIVITY_ROLLUP_INTERVAL']
+ACTIVITY_RETENTION_DAYS = config['ACTIVITY_RETENTION_DAYS']
+ANALYZE_INTERVAL = config['ANALYZE_INTERVAL']
+VACUUM_INTERVAL = config['VACUUM_INTERVAL']
+WEBHOOK_SWEEP_INTERVAL = config['WEBHOOK_SWEEP_INTERVAL']
+WEBHOOK_SWEEP_BUDGET = config['WEBHOOK_SWEEP_BUDGET']
+WEBHOOK_SWEEP_CONCURRENCY = config['WEBHOOK_SWEEP_CONCURRENCY']
+WEBHOOK_SWEEP_RATE = config['WEBHOOK_SWEEP_RATE']
+SLOW_UPDATE_SECONDS = config['SLOW_UPDATE_SECONDS']
+TRACE_BUFFER_SIZE = config['TRACE_BUFFER_SIZE']
+PROFILE_MAX_SECONDS = config['PROFILE_MAX_SECONDS']
 
 # Admin IDs
 ADMIN_IDS = [7713987088, 7475473197]
@@ -95,251 +231,3121 @@ ADMIN_IDS = [7713987088, 7475473197]
 app = Flask(__name__)
 bot_instance = None
 
-# ==================== GITHUB AUTO-BACKUP SYSTEM ====================
+# ==================== METRICS ====================
 
-class GitHubAutoBackup:
-    """GitHub automatic backup system"""
+class Metrics:
+    """Thread-safe Prometheus-style counters, gauges and histograms"""
+    
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    SIZE_BUCKETS = (1024, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+    
+    HELP = {
+        'webhook_to_handler_seconds': ('histogram', 'Time from webhook receipt to handler start'),
+        'handler_duration_seconds': ('histogram', 'Update handler duration by command'),
+        'sqlite_statement_seconds': ('histogram', 'SQLite statement execution time by operation'),
+        'sqlite_lock_wait_seconds': ('histogram', 'Time spent waiting for the SQLite write lock'),
+        'outbound_request_seconds': ('histogram', 'Outbound HTTP latency by service and endpoint'),
+        'backup_size_bytes': ('histogram', 'Size of uploaded backups'),
+        'backup_duration_seconds': ('histogram', 'Backup upload duration'),
+        'backup_restore_seconds': ('histogram', 'Full backup download duration'),
+        'updates_in_flight': ('gauge', 'Updates currently being processed'),
+        'provision_stage_seconds': ('histogram', 'Provisioning stage duration by stage and outcome'),
+        'provision_jobs_total': ('counter', 'Finished provisioning jobs by result'),
+        'token_cache_total': ('counter', 'Verified-token cache lookups by result'),
+        'scheduler_job_seconds': ('histogram', 'Run time of scheduled maintenance jobs'),
+        'scheduler_job_runs_total': ('counter', 'Scheduled job runs by result (ok, error, overlap, leased)'),
+        'webhook_checks_total': ('counter', 'Hosted-bot webhook checks by result'),
+        'child_pending_updates': ('gauge', 'Pending updates across active hosted bots at the last sweep'),
+        'bulk_rows_total': ('counter', 'Rows streamed by the bulk export/import API'),
+        'shards_open': ('gauge', 'Open tenant shard connections'),
+        'shard_evictions_total': ('counter', 'Tenant shards evicted from the open-connection LRU'),
+        'shard_backups_total': ('counter', 'Tenant shard backups by result'),
+        'shard_backup_bytes': ('histogram', 'Size of uploaded tenant shard backups'),
+        'wal_capture_seconds': ('histogram', 'Time the WAL shipper holds the write lock per capture'),
+        'wal_segment_bytes': ('histogram', 'Compressed size of shipped WAL segments'),
+        'wal_segments_shipped_total': ('counter', 'WAL segments uploaded to the backup store'),
+        'slow_updates_total': ('counter', 'Updates slower than SLOW_UPDATE_SECONDS (traced)'),
+        'updates_total': ('counter', 'Updates processed'),
+        'update_errors_total': ('counter', 'Updates that raised an error'),
+    }
     
     def __init__(self):
-        self.repo_full = f"{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}"
-        self.backup_path = GITHUB_BACKUP_PATH
-        self.api_base = "https://api.github.com"
-        self.auth_header = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
+        self.lock = Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+    
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+    
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def gauge_add(self, name, value, **labels):
+        """Add to (or subtract from) a gauge"""
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+    
+    def observe(self, name, value, buckets=None, **labels):
+        """Record a histogram observation"""
+        key = self._key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                bounds = buckets or self.LATENCY_BUCKETS
+                hist = self.histograms[key] = {'bounds': bounds, 'counts': [0] * (len(bounds) + 1), 'sum': 0.0, 'count': 0}
+            hist['counts'][bisect.bisect_left(hist['bounds'], value)] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time a block into a latency histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+    
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+    
+    def render(self):
+        """Render all metrics in Prometheus text exposition format"""
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: {'bounds': v['bounds'], 'counts': list(v['counts']), 'sum': v['sum'], 'count': v['count']}
+                          for k, v in self.histograms.items()}
+        
+        lines = []
+        described = set()
+        
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                help_text = self.HELP.get(name, (kind, name))[1]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        
+        for (name, labels), value in sorted(gauges.items()):
+            describe(name, 'gauge')
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        
+        for (name, labels), hist in sorted(histograms.items()):
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(hist['bounds'], hist['counts']):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {hist['sum']}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {hist['count']}")
+        
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def http_request(service, endpoint, method, url, **kwargs):
+    """Outbound HTTP call with latency recorded per service/endpoint"""
+    kwargs.setdefault('timeout', 30)
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        with tracer.span(service, endpoint):
+            response = requests.request(method, url, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.observe('outbound_request_seconds', time.perf_counter() - start,
+                        service=service, endpoint=endpoint, status=status)
+
+def telegram_request(token, api_method, http_method='POST', **kwargs):
+    """Call a Telegram Bot API method"""
+    url = f"{TELEGRAM_API_BASE}/bot{token}/{api_method}"
+    return http_request('telegram', api_method, http_method, url, **kwargs)
+
+def github_request(endpoint, method, url, **kwargs):
+    """Call the GitHub REST API"""
+    return http_request('github', endpoint, method, url, **kwargs)
+
+# ==================== SQLITE INSTRUMENTATION ====================
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that records per-statement execution time"""
+    
+    def execute(self, sql, parameters=()):
+        op = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+        with metrics.timer('sqlite_statement_seconds', op=op), tracer.span('db', op):
+            return super().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        op = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'EMPTY'
+        with metrics.timer('sqlite_statement_seconds', op=op + '_MANY'), tracer.span('db', op + '_MANY'):
+            return super().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        with metrics.timer('sqlite_statement_seconds', op='SCRIPT'), tracer.span('db', 'SCRIPT'):
+            return super().executescript(sql_script)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors are instrumented
+    
+    The execute shortcuts go through cursor() as well; the built-in ones
+    would create a plain sqlite3.Cursor and skip the instrumentation.
+    """
+    
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+    
+    def commit(self):
+        # A write's fsync happens here, not in its INSERT/UPDATE
+        with metrics.timer('sqlite_statement_seconds', op='COMMIT'), tracer.span('db', 'COMMIT'):
+            return super().commit()
+    
+    def begin_write(self):
+        """Acquire the write lock up front, recording the wait"""
+        with metrics.timer('sqlite_lock_wait_seconds'):
+            self.cursor().execute("BEGIN IMMEDIATE")
+
+def sqlite_snapshot(conn):
+    """Consistent copy of a database (including WAL content) as bytes"""
+    fd, tmp_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        dest = sqlite3.connect(tmp_path)
+        try:
+            conn.backup(dest)
+        finally:
+            dest.close()
+        with open(tmp_path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(tmp_path)
+
+# ==================== TRACING & PROFILING ====================
+
+class Tracer:
+    """Per-update span timing; keeps traces of recent slow updates
+    
+    begin() starts a trace on the current thread, span() records DB and
+    outbound API calls made while it is active, and finish() keeps the
+    trace in a ring buffer of TRACE_BUFFER_SIZE if the update took at
+    least SLOW_UPDATE_SECONDS. Outside a trace span() costs one lookup.
+    """
+    
+    MAX_SPANS = 200
+    
+    def __init__(self, threshold, capacity):
+        self.threshold = threshold
+        self.traces = deque(maxlen=capacity)
+        self.lock = Lock()
+        self.local = threading.local()
+    
+    def begin(self):
+        self.local.trace = {'started': time.perf_counter(), 'spans': [], 'dropped': 0, 'attrs': {}}
+    
+    def annotate(self, **attrs):
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace['attrs'].update(attrs)
+    
+    @contextmanager
+    def span(self, kind, name):
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if len(trace['spans']) < self.MAX_SPANS:
+                trace['spans'].append((kind, name, start - trace['started'], time.perf_counter() - start))
+            else:
+                trace['dropped'] += 1
+    
+    def finish(self, name, duration, **attrs):
+        """End the current trace, keeping it if the update was slow"""
+        trace = getattr(self.local, 'trace', None)
+        self.local.trace = None
+        if trace is None or duration < self.threshold:
+            return
+        
+        totals = {}
+        for kind, _, _, elapsed in trace['spans']:
+            totals[kind] = totals.get(kind, 0) + elapsed
+        record = {
+            'name': name,
+            'at': datetime.now().isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'attrs': {**trace['attrs'], **attrs},
+            'span_totals_ms': {kind: round(elapsed * 1000, 2) for kind, elapsed in totals.items()},
+            'spans': [
+                {'kind': kind, 'name': span_name, 'offset_ms': round(offset * 1000, 2), 'duration_ms': round(elapsed * 1000, 2)}
+                for kind, span_name, offset, elapsed in sorted(trace['spans'], key=lambda span: span[2])
+            ],
+            'dropped_spans': trace['dropped']
         }
+        with self.lock:
+            self.traces.append(record)
+        metrics.inc('slow_updates_total', handler=name)
+    
+    def slowest(self, limit=20):
+        with self.lock:
+            traces = list(self.traces)
+        return sorted(traces, key=lambda t: t['duration_ms'], reverse=True)[:limit]
+
+class SamplingProfiler:
+    """Wall-clock stack sampler over all threads via sys._current_frames
+    
+    Output is collapsed stacks ("thread;outer;...;inner count" per line),
+    which flamegraph.pl and speedscope read directly.
+    """
+    
+    def __init__(self):
+        self.lock = Lock()
+    
+    @staticmethod
+    def thread_label(name):
+        # Fold per-request threads ("Thread-12 (process_update)") and pool
+        # workers ("scheduler_0") into one root each
+        return re.sub(r'[-_]\d+', '', name).replace(';', ':')
+    
+    def profile(self, seconds, interval):
+        """Sample for `seconds`; None if another profile is already running"""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            counts = {}
+            own = threading.get_ident()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(self.thread_label(names.get(ident, 'unknown')))
+                    key = ';'.join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
+                samples += 1
+                time.sleep(interval)
+            
+            print(f"🔬 Profiled {samples} samples over {seconds}s")
+            return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        finally:
+            self.lock.release()
+
+tracer = Tracer(SLOW_UPDATE_SECONDS, TRACE_BUFFER_SIZE)
+profiler = SamplingProfiler()
+
+# ==================== BACKUP STORAGE ====================
+
+class BackupStoreUnavailable(Exception):
+    """The store could not be listed or read, so whether it holds backups is unknown"""
+
+class BackupStore:
+    """Base class for backup storage backends
+    
+    Backends implement put_object/get_object/list_objects for small files
+    and put_large/get_large for database images, which are transferred in
+    BACKUP_CHUNK_SIZE pieces on BACKUP_PARALLELISM threads.
+    """
+    
+    name = "backup"
+    
+    def __init__(self):
+        self.chunk_size = BACKUP_CHUNK_SIZE
+        self.parallelism = BACKUP_PARALLELISM
         self.backup_count = 0
         self.last_backup = None
-        print(f"✅ GitHub Backup: {self.repo_full}")
+    
+    def describe(self):
+        return self.name
+    
+    def put_object(self, name, content, message=None):
+        raise NotImplementedError
+    
+    def get_object(self, name):
+        raise NotImplementedError
+    
+    def list_objects(self, prefix):
+        raise NotImplementedError
+    
+    def put_large(self, name, content, message=None):
+        return self.put_object(name, content, message)
+    
+    def get_large(self, name):
+        return self.get_object(name)
+    
+    def put_objects(self, objects, message=None):
+        """Upload {name: content} together; True only if every upload succeeded"""
+        return all(self._parallel(lambda item: self.put_large(item[0], item[1], message), list(objects.items())))
+    
+    def delete_objects(self, names):
+        """Delete files, or directories with everything under them"""
+        raise NotImplementedError
+    
+    def get_versioned(self, name):
+        """(content, version) of a small object, for put_if_version
+        
+        Both are None if the object does not exist; returns None if the
+        store could not be read.
+        """
+        raise NotImplementedError
+    
+    def put_if_version(self, name, content, version, message=None):
+        """Write only if the object is still at version (None: still absent)"""
+        raise NotImplementedError
+    
+    def acquire_lease(self, name, owner, ttl):
+        """Take or renew leases/<name>.json for ttl seconds
+        
+        False if another owner holds an unexpired lease, won the race for
+        an expired one, or the store could not be reached.
+        """
+        path = f"leases/{name}.json"
+        current = self.get_versioned(path)
+        if current is None:
+            return False
+        content, version = current
+        now = time.time()
+        if content is not None:
+            try:
+                lease = json.loads(content)
+            except ValueError:
+                lease = {}
+            if lease.get('owner') != owner and lease.get('expires_at', 0) > now:
+                return False
+        body = json.dumps({'owner': owner, 'expires_at': now + ttl}).encode('utf-8')
+        return self.put_if_version(path, body, version, f"🔒 Lease: {name}")
+    
+    def _chunks(self, content):
+        return [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)] or [b'']
+    
+    def _parallel(self, func, items):
+        """Run func over items on the backup thread pool, preserving order"""
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            return list(pool.map(func, items))
     
     def create_backup(self, db_content, reason="auto"):
-        """Create backup to GitHub"""
+        """Upload a full database backup"""
+        start = time.perf_counter()
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"masterbot_{timestamp}.db"
-            filepath = f"{self.backup_path}/{filename}"
-            
-            # Encode content
-            encoded = base64.b64encode(db_content).decode('utf-8')
-            
-            # Check if file exists
-            check_url = f"{self.api_base}/repos/{self.repo_full}/contents/{filepath}"
-            check_resp = requests.get(check_url, headers=self.auth_header, timeout=30)
-            
-            commit_data = {
-                "message": f"🤖 Backup: {reason} - {timestamp}",
-                "content": encoded,
-                "branch": GITHUB_BACKUP_BRANCH
-            }
             
-            if check_resp.status_code == 200:
-                commit_data["sha"] = check_resp.json()["sha"]
-            
-            # Upload file
-            url = f"{self.api_base}/repos/{self.repo_full}/contents/{filepath}"
-            response = requests.put(url, headers=self.auth_header, json=commit_data, timeout=30)
-            
-            if response.status_code in [200, 201]:
+            if self.put_large(filename, db_content, f"🤖 Backup: {reason} - {timestamp}"):
                 self.backup_count += 1
                 self.last_backup = datetime.now()
+                metrics.observe('backup_size_bytes', len(db_content), buckets=Metrics.SIZE_BUCKETS)
+                metrics.observe('backup_duration_seconds', time.perf_counter() - start)
                 print(f"✅ Backup created: {filename}")
                 return {"success": True, "filename": filename}
             else:
-                print(f"❌ Backup failed: {response.status_code}")
-                return {"success": False, "error": response.text}
+                print(f"❌ Backup failed: {filename}")
+                return {"success": False, "error": f"Upload of {filename} failed"}
                 
         except Exception as e:
             print(f"❌ Backup error: {e}")
             return {"success": False, "error": str(e)}
     
-    def get_latest_backup(self):
-        """Get latest backup from GitHub"""
+    def get_latest_backup(self, prefix=''):
+        """Get latest full backup (name relative to prefix), or None if there is none"""
+        names = self.list_objects(prefix)
+        if names is None:
+            raise BackupStoreUnavailable(f"Could not list backups in {self.describe()}")
+        db_files = {n[:-len('.manifest')] if n.endswith('.db.manifest') else n for n in names}
+        db_files = [n for n in db_files if n.endswith('.db')]
+        if db_files:
+            return {'name': max(db_files)}
+        return None
+    
+    def restore_backup(self, filename):
+        """Download a full backup"""
+        try:
+            with metrics.timer('backup_restore_seconds'):
+                return self.get_large(filename)
+        except Exception as e:
+            print(f"❌ Restore error: {e}")
+            return None
+
+class GitHubAutoBackup(BackupStore):
+    """GitHub repository backend
+    
+    Small files use the contents API. Large objects are split into chunks
+    that are uploaded as git blobs in parallel and committed together in a
+    single commit, with a <name>.manifest listing the blob SHAs so restore
+    can fetch them in parallel.
+    """
+    
+    name = "github"
+    
+    def __init__(self):
+        super().__init__()
+        self.repo_full = f"{GITHUB_REPO_OWNER}/{GITHUB_REPO_NAME}"
+        self.backup_path = GITHUB_BACKUP_PATH
+        self.api_base = GITHUB_API_BASE
+        self.repo_url = f"{self.api_base}/repos/{self.repo_full}"
+        self.auth_header = {
+            "Authorization": f"token {GITHUB_TOKEN}",
+            "Accept": "application/vnd.github.v3+json"
+        }
+        print(f"✅ GitHub Backup: {self.repo_full}")
+    
+    def describe(self):
+        return f"GitHub {self.repo_full}@{GITHUB_BACKUP_BRANCH}:{self.backup_path}"
+    
+    def _contents_url(self, name):
+        return f"{self.repo_url}/contents/{self.backup_path}/{name}".rstrip('/')
+    
+    def put_object(self, name, content, message=None):
+        """Upload a file under the backup path"""
         try:
-            url = f"{self.api_base}/repos/{self.repo_full}/contents/{self.backup_path}"
-            response = requests.get(url, headers=self.auth_header, timeout=30)
+            commit_data = {
+                "message": message or f"🤖 Backup: {name}",
+                "content": base64.b64encode(content).decode('utf-8'),
+                "branch": GITHUB_BACKUP_BRANCH
+            }
+            url = self._contents_url(name)
+            response = github_request('contents_put', 'PUT', url, headers=self.auth_header, json=commit_data, timeout=30)
+            
+            if response.status_code == 422:
+                # File already exists; overwriting needs its current sha
+                check_resp = github_request('contents_get', 'GET', url, headers=self.auth_header,
+                                            params={'ref': GITHUB_BACKUP_BRANCH}, timeout=30)
+                if check_resp.status_code == 200:
+                    commit_data["sha"] = check_resp.json()["sha"]
+                    response = github_request('contents_put', 'PUT', url, headers=self.auth_header, json=commit_data, timeout=30)
             
+            if response.status_code in [200, 201]:
+                return True
+            print(f"❌ Upload failed ({name}): {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ Upload error ({name}): {e}")
+            return False
+    
+    def get_versioned(self, name):
+        """File contents and blob sha; the sha is the contents API's PUT precondition"""
+        try:
+            response = github_request('contents_get', 'GET', self._contents_url(name), headers=self.auth_header,
+                                      params={'ref': GITHUB_BACKUP_BRANCH}, timeout=30)
+            if response.status_code == 404:
+                return None, None
             if response.status_code == 200:
-                files = response.json()
-                db_files = [f for f in files if f['name'].endswith('.db')]
-                if db_files:
-                    latest = max(db_files, key=lambda x: x['name'])
-                    return latest
+                data = response.json()
+                return base64.b64decode(data['content']), data['sha']
+            print(f"❌ Download failed ({name}): {response.status_code}")
             return None
         except Exception as e:
-            print(f"❌ Get backup error: {e}")
+            print(f"❌ Download error ({name}): {e}")
             return None
     
-    def restore_backup(self, filename):
-        """Restore backup from GitHub"""
+    def put_if_version(self, name, content, version, message=None):
+        """Contents API PUT with the file's sha (without one it only creates)"""
         try:
-            filepath = f"{self.backup_path}/{filename}"
-            url = f"{self.api_base}/repos/{self.repo_full}/contents/{filepath}"
-            response = requests.get(url, headers=self.auth_header, timeout=30)
-            
+            commit_data = {
+                "message": message or f"🤖 Backup: {name}",
+                "content": base64.b64encode(content).decode('utf-8'),
+                "branch": GITHUB_BACKUP_BRANCH
+            }
+            if version:
+                commit_data["sha"] = version
+            response = github_request('contents_put', 'PUT', self._contents_url(name), headers=self.auth_header,
+                                      json=commit_data, timeout=30)
+            if response.status_code in (200, 201):
+                return True
+            # 409: the sha is stale; 422: the file exists and no sha was given
+            if response.status_code not in (409, 422):
+                print(f"❌ Conditional upload failed ({name}): {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ Conditional upload error ({name}): {e}")
+            return False
+    
+    def _tree_entries(self, prefix):
+        """Entries directly under a backup sub-path, via the git trees API
+        
+        Unlike the contents API (capped at 1000 entries per directory) a
+        tree listing returns up to 100,000 entries.
+        """
+        path = f"{self.backup_path}/{prefix}".strip('/')
+        try:
+            response = github_request('git_tree_get', 'GET', f"{self.repo_url}/git/trees/{GITHUB_BACKUP_BRANCH}:{path}",
+                                      headers=self.auth_header, timeout=30)
             if response.status_code == 200:
-                content = response.json()['content']
-                decoded = base64.b64decode(content)
-                return decoded
+                data = response.json()
+                if data.get('truncated'):
+                    print(f"❌ Listing of {prefix} was truncated")
+                    return None
+                return data['tree']
+            if response.status_code == 404:
+                return []
+            print(f"❌ List failed ({prefix}): {response.status_code}")
             return None
         except Exception as e:
-            print(f"❌ Restore error: {e}")
+            print(f"❌ List error ({prefix}): {e}")
             return None
-
-# ==================== DATABASE MANAGER ====================
-
-class DatabaseManager:
-    """Database with auto-backup functionality"""
     
-    def __init__(self, github_backup):
-        self.db_path = "masterbot.db"
-        self.github_backup = github_backup
-        self.process_count = 0
-        self.backup_threshold = 5
-        self.setup_database()
+    def list_objects(self, prefix):
+        """List file and directory names directly under a backup sub-path"""
+        entries = self._tree_entries(prefix)
+        return None if entries is None else [entry['path'] for entry in entries]
     
-    def setup_database(self):
-        """Setup database tables"""
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        cursor = conn.cursor()
+    def _download(self, name):
+        headers = dict(self.auth_header, Accept="application/vnd.github.raw")
+        return github_request('contents_get', 'GET', self._contents_url(name), headers=headers,
+                              params={'ref': GITHUB_BACKUP_BRANCH}, timeout=60)
+    
+    def get_object(self, name):
+        """Download a file under the backup path as raw bytes"""
+        try:
+            response = self._download(name)
+            if response.status_code == 200:
+                return response.content
+            print(f"❌ Download failed ({name}): {response.status_code}")
+            return None
+        except Exception as e:
+            print(f"❌ Download error ({name}): {e}")
+            return None
+    
+    def _create_blob(self, chunk):
+        response = github_request('git_blob_create', 'POST', f"{self.repo_url}/git/blobs", headers=self.auth_header, json={
+            "content": base64.b64encode(chunk).decode('utf-8'),
+            "encoding": "base64"
+        }, timeout=120)
+        if response.status_code != 201:
+            raise RuntimeError(f"blob upload failed: {response.status_code}")
+        return response.json()['sha']
+    
+    def _get_blob(self, sha):
+        headers = dict(self.auth_header, Accept="application/vnd.github.raw")
+        response = github_request('git_blob_get', 'GET', f"{self.repo_url}/git/blobs/{sha}", headers=headers, timeout=120)
+        if response.status_code != 200:
+            raise RuntimeError(f"blob download failed: {response.status_code}")
+        return response.content
+    
+    def _commit_blobs(self, files, message, attempts=3, deleted_trees=()):
+        """Commit {name: blob_sha} under the backup path in a single commit
         
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                stars INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        A sha of None deletes that file; deleted_trees names directories to
+        remove with everything under them.
+        """
+        ref_path = f"heads/{GITHUB_BACKUP_BRANCH}"
+        for attempt in range(attempts):
+            ref = github_request('git_ref_get', 'GET', f"{self.repo_url}/git/ref/{ref_path}", headers=self.auth_header, timeout=30)
+            ref.raise_for_status()
+            head_sha = ref.json()['object']['sha']
+            
+            head = github_request('git_commit_get', 'GET', f"{self.repo_url}/git/commits/{head_sha}", headers=self.auth_header, timeout=30)
+            head.raise_for_status()
+            
+            tree = github_request('git_tree_create', 'POST', f"{self.repo_url}/git/trees", headers=self.auth_header, json={
+                "base_tree": head.json()['tree']['sha'],
+                "tree": [
+                    {"path": f"{self.backup_path}/{name}", "mode": "100644", "type": "blob", "sha": sha}
+                    for name, sha in files.items()
+                ] + [
+                    {"path": f"{self.backup_path}/{name}", "mode": "040000", "type": "tree", "sha": None}
+                    for name in deleted_trees
+                ]
+            }, timeout=60)
+            tree.raise_for_status()
+            
+            commit = github_request('git_commit_create', 'POST', f"{self.repo_url}/git/commits", headers=self.auth_header, json={
+                "message": message,
+                "tree": tree.json()['sha'],
+                "parents": [head_sha]
+            }, timeout=30)
+            commit.raise_for_status()
+            
+            update = github_request('git_ref_update', 'PATCH', f"{self.repo_url}/git/refs/{ref_path}", headers=self.auth_header,
+                                    json={"sha": commit.json()['sha']}, timeout=30)
+            if update.status_code == 200:
+                return True
+            if update.status_code != 422:
+                update.raise_for_status()
+            print(f"⚠️ Branch moved during backup commit, retrying ({attempt + 1}/{attempts})")
+        return False
+    
+    def _chunked_files(self, name, content):
+        """Upload chunks as parallel blobs; returns the tree entries to commit"""
+        blob_shas = self._parallel(self._create_blob, self._chunks(content))
+        manifest = json.dumps({
+            "size": len(content),
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "chunk_size": self.chunk_size,
+            "blobs": blob_shas
+        }).encode('utf-8')
+        files = {f"{name}.parts/{i:05d}": sha for i, sha in enumerate(blob_shas)}
+        files[f"{name}.manifest"] = self._create_blob(manifest)
+        return files
+    
+    def put_large(self, name, content, message=None):
+        """Upload chunks as parallel blobs plus a manifest, in one commit"""
+        if len(content) <= self.chunk_size:
+            return self.put_object(name, content, message)
+        return self.put_objects({name: content}, message or f"🤖 Backup: {name}")
+    
+    def _stale_layout(self, parts):
+        """Files left by an object's previous layout, for deletion in the same commit
         
-        # Star payments
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS star_payments (
-                payment_id TEXT PRIMARY KEY,
-                user_id INTEGER,
-                amount INTEGER,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                verified_at TIMESTAMP
-            )
-        ''')
+        parts maps each name being written to its chunk count (0 for a plain
+        file). A plain write drops <name>.manifest and <name>.parts, which
+        get_large would otherwise prefer; a chunked write drops the plain
+        file and parts beyond the new count. Returns (files, trees).
+        """
+        listings = {}
         
-        # User bots
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_bots (
-                bot_token TEXT PRIMARY KEY,
-                bot_username TEXT,
-                owner_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active INTEGER DEFAULT 1
-            )
-        ''')
+        def entries(path):
+            if path not in listings:
+                listing = self._tree_entries(path)
+                if listing is None:
+                    raise RuntimeError(f"could not list {path or '/'}")
+                listings[path] = [entry['path'] for entry in listing]
+            return listings[path]
         
-        # Activity logs
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activity_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action TEXT,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        files, trees = {}, []
+        for name, count in parts.items():
+            parent, _, base = name.rpartition('/')
+            siblings = entries(parent)
+            if count == 0:
+                if f"{base}.manifest" in siblings:
+                    files[f"{name}.manifest"] = None
+                if f"{base}.parts" in siblings:
+                    trees.append(f"{name}.parts")
+            else:
+                if base in siblings:
+                    files[name] = None
+                if f"{base}.parts" in siblings:
+                    files.update({f"{name}.parts/{part}": None for part in entries(f"{name}.parts") if int(part) >= count})
+        return files, trees
+    
+    def put_objects(self, objects, message=None):
+        """Upload every object as blobs and commit them all in one commit"""
+        try:
+            small = [(name, content) for name, content in objects.items() if len(content) <= self.chunk_size]
+            files = dict(zip([name for name, _ in small], self._parallel(self._create_blob, [c for _, c in small])))
+            parts = {name: 0 for name, _ in small}
+            for name, content in objects.items():
+                if len(content) > self.chunk_size:
+                    chunked = self._chunked_files(name, content)
+                    parts[name] = len(chunked) - 1
+                    files.update(chunked)
+            stale_files, stale_trees = self._stale_layout(parts)
+            files.update(stale_files)
+            return self._commit_blobs(files, message or f"🤖 Backup: {len(objects)} objects", deleted_trees=stale_trees)
+        except Exception as e:
+            print(f"❌ Batch upload error: {e}")
+            return False
+    
+    def delete_objects(self, names):
+        """Delete files and directories in a single commit"""
+        try:
+            parents = {}
+            for name in names:
+                parent, _, base = name.rpartition('/')
+                parents.setdefault(parent, set()).add(base)
+            files, trees = {}, []
+            for parent, bases in parents.items():
+                entries = self._tree_entries(parent)
+                if entries is None:
+                    return False
+                for entry in entries:
+                    if entry['path'] in bases:
+                        path = f"{parent}/{entry['path']}" if parent else entry['path']
+                        if entry['type'] == 'tree':
+                            trees.append(path)
+                        else:
+                            files[path] = None
+            if not files and not trees:
+                return True
+            return self._commit_blobs(files, f"🧹 Prune: {len(files) + len(trees)} objects", deleted_trees=trees)
+        except Exception as e:
+            print(f"❌ Delete error: {e}")
+            return False
+    
+    def get_large(self, name):
+        """Download a chunked object in parallel (or a plain file)"""
+        try:
+            response = self._download(f"{name}.manifest")
+            if response.status_code == 404:
+                return self.get_object(name)
+            response.raise_for_status()
+            manifest = json.loads(response.content)
+            content = b''.join(self._parallel(self._get_blob, manifest['blobs']))
+            if len(content) != manifest['size'] or hashlib.sha256(content).hexdigest() != manifest['sha256']:
+                print(f"❌ Checksum mismatch restoring {name}")
+                return None
+            return content
+        except Exception as e:
+            print(f"❌ Chunked download error ({name}): {e}")
+            return None
+
+class S3Store(BackupStore):
+    """S3-compatible backend (AWS, MinIO, R2, ...) using path-style requests
+    
+    Large objects use multipart upload with parts sent in parallel; restores
+    use parallel ranged GETs.
+    """
+    
+    name = "s3"
+    
+    def __init__(self):
+        super().__init__()
+        self.endpoint = S3_ENDPOINT
+        self.region = S3_REGION
+        self.bucket = S3_BUCKET
+        self.prefix = S3_PREFIX
+        self.access_key = S3_ACCESS_KEY_ID
+        self.secret_key = S3_SECRET_ACCESS_KEY
+        self.host = urlparse(self.endpoint).netloc
+        print(f"✅ S3 Backup: {self.endpoint}/{self.bucket}/{self.prefix}")
+    
+    def describe(self):
+        return f"S3 {self.bucket}/{self.prefix}"
+    
+    def _key(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+    
+    def _signing_key(self, date):
+        key = hmac.new(f"AWS4{self.secret_key}".encode('utf-8'), date.encode('utf-8'), hashlib.sha256).digest()
+        for part in (self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        return key
+    
+    def _request(self, endpoint, method, key='', query=None, body=b'', headers=None, timeout=60):
+        """Send a SigV4-signed request"""
+        now = datetime.utcnow()
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+        payload_hash = hashlib.sha256(body).hexdigest()
+        
+        path = f"/{self.bucket}/{quote(key, safe='/-_.~')}" if key else f"/{self.bucket}"
+        canonical_query = "&".join(
+            f"{quote(str(k), safe='-_.~')}={quote(str(v), safe='-_.~')}"
+            for k, v in sorted((query or {}).items())
+        )
+        headers = dict(headers or {}, **{
+            'host': self.host,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date
+        })
+        signed = sorted(k.lower() for k in headers)
+        lowered = {k.lower(): str(v).strip() for k, v in headers.items()}
+        canonical_request = "\n".join([
+            method, path, canonical_query,
+            "".join(f"{k}:{lowered[k]}\n" for k in signed),
+            ";".join(signed), payload_hash
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        signature = hmac.new(self._signing_key(date), string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={';'.join(signed)}, Signature={signature}"
+        )
+        del headers['host']
+        
+        url = f"{self.endpoint}{path}" + (f"?{canonical_query}" if canonical_query else "")
+        return http_request('s3', endpoint, method, url, data=body or None, headers=headers, timeout=timeout)
+    
+    @staticmethod
+    def _xml_find(element, tag):
+        return [child for child in element.iter() if child.tag.rsplit('}', 1)[-1] == tag]
+    
+    def put_object(self, name, content, message=None):
+        try:
+            response = self._request('put_object', 'PUT', self._key(name), body=content)
+            if response.status_code == 200:
+                return True
+            print(f"❌ S3 upload failed ({name}): {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ S3 upload error ({name}): {e}")
+            return False
+    
+    def get_object(self, name):
+        try:
+            response = self._request('get_object', 'GET', self._key(name))
+            if response.status_code == 200:
+                return response.content
+            print(f"❌ S3 download failed ({name}): {response.status_code}")
+            return None
+        except Exception as e:
+            print(f"❌ S3 download error ({name}): {e}")
+            return None
+    
+    def get_versioned(self, name):
+        """Object and its ETag, the If-Match precondition"""
+        try:
+            response = self._request('get_object', 'GET', self._key(name))
+            if response.status_code == 404:
+                return None, None
+            if response.status_code == 200:
+                return response.content, response.headers.get('ETag')
+            print(f"❌ S3 download failed ({name}): {response.status_code}")
+            return None
+        except Exception as e:
+            print(f"❌ S3 download error ({name}): {e}")
+            return None
+    
+    def put_if_version(self, name, content, version, message=None):
+        """PUT with If-Match, or If-None-Match: * to only create"""
+        try:
+            headers = {'If-Match': version} if version else {'If-None-Match': '*'}
+            response = self._request('put_object', 'PUT', self._key(name), body=content, headers=headers)
+            if response.status_code == 200:
+                return True
+            # 412 (or 409 for a concurrent conditional write): another writer won
+            if response.status_code not in (404, 409, 412):
+                print(f"❌ S3 conditional upload failed ({name}): {response.status_code}")
+            return False
+        except Exception as e:
+            print(f"❌ S3 conditional upload error ({name}): {e}")
+            return False
+    
+    def list_objects(self, prefix):
+        """List file and directory names directly under a sub-path"""
+        try:
+            base = self._key(prefix).rstrip('/') + '/' if (prefix or self.prefix) else ''
+            names = []
+            token = None
+            while True:
+                query = {'list-type': '2', 'prefix': base, 'delimiter': '/'}
+                if token:
+                    query['continuation-token'] = token
+                response = self._request('list_objects', 'GET', query=query)
+                if response.status_code != 200:
+                    print(f"❌ S3 list failed ({prefix}): {response.status_code}")
+                    return None
+                root = ElementTree.fromstring(response.content)
+                for element in self._xml_find(root, 'Key'):
+                    names.append(element.text[len(base):])
+                for element in self._xml_find(root, 'Prefix'):
+                    if element.text and element.text != base:
+                        names.append(element.text[len(base):].rstrip('/'))
+                truncated = self._xml_find(root, 'IsTruncated')
+                tokens = self._xml_find(root, 'NextContinuationToken')
+                if not (truncated and truncated[0].text == 'true' and tokens):
+                    return names
+                token = tokens[0].text
+        except Exception as e:
+            print(f"❌ S3 list error ({prefix}): {e}")
+            return None
+    
+    def delete_objects(self, names):
+        """Delete keys, and every key under names used as directories"""
+        try:
+            keys = []
+            for name in names:
+                key = self._key(name)
+                keys.append(key)
+                token = None
+                while True:
+                    query = {'list-type': '2', 'prefix': key + '/'}
+                    if token:
+                        query['continuation-token'] = token
+                    response = self._request('list_objects', 'GET', query=query)
+                    if response.status_code != 200:
+                        print(f"❌ S3 list failed ({name}): {response.status_code}")
+                        return False
+                    root = ElementTree.fromstring(response.content)
+                    keys.extend(element.text for element in self._xml_find(root, 'Key'))
+                    truncated = self._xml_find(root, 'IsTruncated')
+                    tokens = self._xml_find(root, 'NextContinuationToken')
+                    if not (truncated and truncated[0].text == 'true' and tokens):
+                        break
+                    token = tokens[0].text
+            
+            def delete(key):
+                return self._request('delete_object', 'DELETE', key).status_code in (200, 204)
+            return all(self._parallel(delete, keys))
+        except Exception as e:
+            print(f"❌ S3 delete error: {e}")
+            return False
+    
+    def put_large(self, name, content, message=None):
+        """Multipart upload with parts sent in parallel"""
+        if len(content) <= self.chunk_size:
+            return self.put_object(name, content, message)
+        key = self._key(name)
+        upload_id = None
+        try:
+            response = self._request('multipart_create', 'POST', key, query={'uploads': ''})
+            response.raise_for_status()
+            upload_id = self._xml_find(ElementTree.fromstring(response.content), 'UploadId')[0].text
+            
+            def upload_part(item):
+                number, chunk = item
+                part = self._request('multipart_part', 'PUT', key, body=chunk, timeout=300,
+                                     query={'partNumber': number, 'uploadId': upload_id})
+                part.raise_for_status()
+                return number, part.headers['ETag']
+            
+            parts = self._parallel(upload_part, list(enumerate(self._chunks(content), start=1)))
+            body = "<CompleteMultipartUpload>" + "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+            ) + "</CompleteMultipartUpload>"
+            response = self._request('multipart_complete', 'POST', key, query={'uploadId': upload_id},
+                                     body=body.encode('utf-8'), timeout=300)
+            response.raise_for_status()
+            if b'<Error>' in response.content:
+                raise RuntimeError(response.text)
+            return True
+        except Exception as e:
+            print(f"❌ S3 multipart upload error ({name}): {e}")
+            if upload_id:
+                try:
+                    self._request('multipart_abort', 'DELETE', key, query={'uploadId': upload_id})
+                except Exception:
+                    pass
+            return False
+    
+    def get_large(self, name):
+        """Download with parallel ranged GETs"""
+        key = self._key(name)
+        try:
+            head = self._request('head_object', 'HEAD', key)
+            if head.status_code != 200:
+                print(f"❌ S3 download failed ({name}): {head.status_code}")
+                return None
+            size = int(head.headers.get('Content-Length', 0))
+            if size <= self.chunk_size:
+                return self.get_object(name)
+            
+            def get_range(start):
+                end = min(start + self.chunk_size, size) - 1
+                part = self._request('get_range', 'GET', key, headers={'Range': f"bytes={start}-{end}"}, timeout=300)
+                if part.status_code != 206 or len(part.content) != end - start + 1:
+                    raise RuntimeError(f"range {start}-{end} failed: {part.status_code}")
+                return part.content
+            
+            return b''.join(self._parallel(get_range, list(range(0, size, self.chunk_size))))
+        except Exception as e:
+            print(f"❌ S3 download error ({name}): {e}")
+            return None
+
+class LocalDirectoryStore(BackupStore):
+    """Backup store on a local directory (tests, benchmarks, mounted disks)"""
+    
+    name = "local"
+    
+    def __init__(self, root):
+        super().__init__()
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        print(f"✅ Local backup store: {self.root}")
+    
+    def describe(self):
+        return f"Local {self.root}"
+    
+    def _path(self, name):
+        path = os.path.abspath(os.path.join(self.root, name))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise ValueError(f"Path escapes backup store: {name}")
+        return path
+    
+    def _write(self, name, write):
+        """Write through a temp file and rename, so readers never see partial files"""
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    
+    def put_object(self, name, content, message=None):
+        """Write a file atomically"""
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                f.write(content)
+        try:
+            self._write(name, write)
+            return True
+        except Exception as e:
+            print(f"❌ Local upload error ({name}): {e}")
+            return False
+    
+    def list_objects(self, prefix):
+        """List file and directory names directly under a sub-path"""
+        try:
+            return sorted(n for n in os.listdir(self._path(prefix)) if not n.endswith('.tmp') and n != '.lock')
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            print(f"❌ Local list error ({prefix}): {e}")
+            return None
+    
+    def delete_objects(self, names):
+        """Remove files and directory trees"""
+        try:
+            for name in names:
+                path = self._path(name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            return True
+        except Exception as e:
+            print(f"❌ Local delete error: {e}")
+            return False
+    
+    def get_versioned(self, name):
+        """File contents; the version is their hash"""
+        try:
+            with open(self._path(name), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            print(f"❌ Local download error ({name}): {e}")
+            return None
+        return content, hashlib.sha256(content).hexdigest()
+    
+    def put_if_version(self, name, content, version, message=None):
+        """Compare and write under an flock, so processes sharing the directory serialize"""
+        try:
+            with open(self._path('.lock'), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                current = self.get_versioned(name)
+                if current is None or current[1] != version:
+                    return False
+                return self.put_object(name, content, message)
+        except Exception as e:
+            print(f"❌ Local upload error ({name}): {e}")
+            return False
+    
+    def get_object(self, name):
+        """Read a file"""
+        try:
+            with open(self._path(name), 'rb') as f:
+                return f.read()
+        except Exception as e:
+            print(f"❌ Local download error ({name}): {e}")
+            return None
+    
+    def put_large(self, name, content, message=None):
+        """Write chunks at their offsets in parallel"""
+        if len(content) <= self.chunk_size:
+            return self.put_object(name, content, message)
+        
+        def write(tmp):
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, len(content))
+                view = memoryview(content)
+                self._parallel(
+                    lambda offset: os.pwrite(fd, view[offset:offset + self.chunk_size], offset),
+                    list(range(0, len(content), self.chunk_size))
+                )
+            finally:
+                os.close(fd)
+        try:
+            self._write(name, write)
+            return True
+        except Exception as e:
+            print(f"❌ Local upload error ({name}): {e}")
+            return False
+    
+    def get_large(self, name):
+        """Read ranges in parallel"""
+        try:
+            fd = os.open(self._path(name), os.O_RDONLY)
+        except Exception as e:
+            print(f"❌ Local download error ({name}): {e}")
+            return None
+        try:
+            size = os.fstat(fd).st_size
+            return b''.join(self._parallel(
+                lambda offset: os.pread(fd, self.chunk_size, offset),
+                list(range(0, size, self.chunk_size))
+            ))
+        finally:
+            os.close(fd)
+
+def create_backup_store():
+    """Build the backend selected by BACKUP_STORE"""
+    if BACKUP_STORE == 's3':
+        return S3Store()
+    if BACKUP_STORE == 'local':
+        return LocalDirectoryStore(BACKUP_STORE_DIR)
+    return GitHubAutoBackup()
+
+# ==================== DATABASE MANAGER ====================
+
+class DatabaseManager:
+    """Database with auto-backup functionality"""
+    
+    def __init__(self, backup_store):
+        self.db_path = "masterbot.db"
+        self.backup_store = backup_store
+        self.process_count = 0
+        self.backup_threshold = 5
+        self.wal_shipper = None
+        self.lock_file = None
+        self.lock_database()
+        self.setup_database()
+    
+    def lock_database(self):
+        """Hold an exclusive lock on the database for the life of the process
+        
+        WAL shipping and shard backups keep per-process state about these
+        files (WAL offsets, dirty shards), so a second process (e.g. another
+        gunicorn worker) must not run against them.
+        """
+        self.lock_file = open(f"{self.db_path}.lock", 'a')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise RuntimeError(
+                f"{self.db_path} is in use by another process; run one process per database "
+                f"(gunicorn --workers 1 --threads N)"
+            )
+    
+    def connect(self):
+        """Open an instrumented connection to the database"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=InstrumentedConnection)
+        if WAL_SHIP_INTERVAL > 0:
+            # The WAL shipper is the only checkpointer, so no frame is
+            # folded into the database before it has been captured
+            conn.execute("PRAGMA wal_autocheckpoint=0")
+            conn.execute(f"PRAGMA journal_size_limit={WAL_CHECKPOINT_BYTES}")
+        return conn
+    
+    def setup_database(self):
+        """Setup database tables"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
+        # Users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                stars INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Star payments
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS star_payments (
+                payment_id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                amount INTEGER,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                verified_at TIMESTAMP
+            )
+        ''')
+        
+        # User bots
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_bots (
+                bot_token TEXT PRIMARY KEY,
+                bot_username TEXT,
+                owner_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active INTEGER DEFAULT 1
+            )
+        ''')
+        
+        # Activity logs
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS activity_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                action TEXT,
+                details TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Bot provisioning jobs
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS provision_jobs (
+                job_id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                chat_id INTEGER,
+                bot_token TEXT,
+                bot_username TEXT,
+                price INTEGER,
+                stage TEXT DEFAULT 'verify',
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_provision_jobs_status ON provision_jobs (status)")
+        
+        # Daily activity counts kept after raw logs are pruned
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS activity_daily (
+                day TEXT,
+                action TEXT,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, action)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_logs_created ON activity_logs (created_at)")
+        
+        # Latest webhook health per hosted bot
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bot_health (
+                bot_token TEXT PRIMARY KEY,
+                tenant_id TEXT,
+                pending_update_count INTEGER DEFAULT 0,
+                last_error_date INTEGER,
+                last_error_message TEXT,
+                status TEXT,
+                checked_at TIMESTAMP
+            )
+        ''')
+        
+        conn.commit()
+        conn.close()
+        print("✅ Database setup complete")
+    
+    def execute_with_backup(self, query, params=(), user_id=None, action=None):
+        """Execute query with auto-backup check"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        try:
+            if isinstance(query, str):
+                conn.begin_write()
+                cursor.execute(query, params)
+            else:
+                cursor.executescript(query)
+            
+            conn.commit()
+            
+            # Log activity
+            if user_id and action:
+                cursor.execute(
+                    "INSERT INTO activity_logs (user_id, action, details) VALUES (?, ?, ?)",
+                    (user_id, action, json.dumps(params))
+                )
+                conn.commit()
+            
+            self.record_write(action)
+            return cursor
+            
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def record_write(self, action=None):
+        """Count a write and back up once the threshold is reached"""
+        self.process_count += 1
+        
+        # WAL shipping replaces threshold backups
+        if self.wal_shipper is None and self.process_count >= self.backup_threshold:
+            self.create_backup(f"auto_after_{action}")
+            self.process_count = 0
+    
+    def rollup_activity(self, retention_days):
+        """Fold activity logs older than the retention window into daily counts"""
+        cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        conn = self.connect()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO activity_daily (day, action, count)
+                SELECT date(created_at), action, COUNT(*) FROM activity_logs
+                WHERE created_at < ? GROUP BY date(created_at), action
+                ON CONFLICT(day, action) DO UPDATE SET count = count + excluded.count
+            ''', (cutoff,))
+            cursor.execute("DELETE FROM activity_logs WHERE created_at < ?", (cutoff,))
+            pruned = cursor.rowcount
+            cursor.execute(
+                "DELETE FROM provision_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (cutoff,)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        if pruned:
+            self.record_write("activity_rollup")
+            print(f"🧹 Rolled up {pruned} activity logs older than {retention_days} days")
+        return pruned
+    
+    def analyze(self):
+        """Refresh query planner statistics"""
+        conn = self.connect()
+        try:
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def vacuum(self):
+        """Rebuild the database file to reclaim free pages"""
+        conn = self.connect()
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    
+    def snapshot_bytes(self, source=None):
+        """Consistent copy of the database, including WAL content"""
+        conn = source or self.connect()
+        try:
+            return sqlite_snapshot(conn)
+        finally:
+            if source is None:
+                conn.close()
+    
+    def replace_database(self, db_content):
+        """Overwrite the database file, discarding any stale WAL"""
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+        with open(self.db_path, 'wb') as f:
+            f.write(db_content)
+    
+    def create_backup(self, reason="manual"):
+        """Create database backup"""
+        try:
+            db_content = self.snapshot_bytes()
+            
+            result = self.backup_store.create_backup(db_content, reason)
+            return result
+        except Exception as e:
+            print(f"❌ Create backup error: {e}")
+            return {"success": False, "error": str(e)}
+    
+    def restore_latest(self):
+        """Restore from latest backup; False when the store holds none
+        
+        Raises BackupStoreUnavailable if the store cannot be listed or a
+        listed backup cannot be downloaded, so an outage is never taken
+        for an empty store.
+        """
+        try:
+            if self.wal_shipper:
+                result = self.wal_shipper.restore(self.db_path)
+                if result:
+                    print(f"✅ Restored from WAL generation {result['generation']} "
+                          f"({result['segments']} segments)")
+                    self.setup_database()
+                    return True
+            
+            latest = self.backup_store.get_latest_backup()
+            if latest:
+                db_content = self.backup_store.restore_backup(latest['name'])
+                if not db_content:
+                    raise BackupStoreUnavailable(f"Could not download backup {latest['name']}")
+                self.replace_database(db_content)
+                print(f"✅ Restored from backup: {latest['name']}")
+                self.setup_database()
+                return True
+            return False
+        except BackupStoreUnavailable:
+            raise
+        except Exception as e:
+            print(f"❌ Restore error: {e}")
+            return False
+
+# ==================== BULK EXPORT / IMPORT ====================
+
+class BulkTransfer:
+    """Streaming table export and batched upsert import
+    
+    Exports walk the primary key (keyset pagination) in EXPORT_BATCH_SIZE
+    reads, so memory stays flat and no read transaction is held between
+    batches; a `limit` page is instead read from one snapshot, so its
+    X-Next-Cursor is the key of its last row. Imports parse the request
+    body line by line and upsert in IMPORT_BATCH_SIZE transactions.
+    """
+    
+    TABLES = {
+        'users': 'user_id',
+        'user_bots': 'bot_token',
+        'star_payments': 'payment_id',
+        'activity_logs': 'id',
+    }
+    FORMATS = ('ndjson', 'csv')
+    # CSV has no NULL, so it is written as \N (as PostgreSQL COPY does) and
+    # an empty field stays an empty string
+    CSV_NULL = '\\N'
+    
+    def __init__(self, db):
+        self.db = db
+        self.export_batch_size = EXPORT_BATCH_SIZE
+        self.import_batch_size = IMPORT_BATCH_SIZE
+        self.columns = {}
+    
+    def table_columns(self, table):
+        if table not in self.columns:
+            conn = self.db.connect()
+            try:
+                self.columns[table] = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            finally:
+                conn.close()
+        return self.columns[table]
+    
+    @staticmethod
+    def encode_cursor(key):
+        return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decode an opaque cursor; raises ValueError if it is malformed"""
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except Exception:
+            raise ValueError("Invalid cursor")
+    
+    def next_cursor(self, conn, table, after, limit):
+        """Cursor for the page after `limit` rows, or None on the last page"""
+        key = self.TABLES[table]
+        where, params = (f"WHERE {key} > ?", [after]) if after is not None else ("", [])
+        rows = conn.execute(
+            f"SELECT {key} FROM {table} {where} ORDER BY {key} LIMIT 2 OFFSET ?",
+            params + [limit - 1]
+        ).fetchall()
+        return self.encode_cursor(rows[0][0]) if len(rows) == 2 else None
+    
+    def export_page(self, table, fmt, after, limit):
+        """(next cursor, row generator) for one page, read from one snapshot
+        
+        The cursor is computed inside the read transaction the page is then
+        streamed from, so it is always the key of the last row emitted.
+        """
+        conn = self.db.connect()
+        try:
+            conn.execute("BEGIN")
+            cursor = self.next_cursor(conn, table, after, limit)
+        except Exception:
+            conn.close()
+            raise
+        return cursor, self.export_rows(table, fmt, after, limit, conn=conn)
+    
+    def export_rows(self, table, fmt='ndjson', after=None, limit=None, conn=None):
+        """Generate the table as NDJSON lines or CSV text, batch by batch
+        
+        A passed-in connection is used as is (and closed at the end).
+        """
+        key = self.TABLES[table]
+        columns = self.table_columns(table)
+        select = f"SELECT {', '.join(columns)} FROM {table}"
+        remaining = limit
+        conn = conn or self.db.connect()
+        try:
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                yield buffer.getvalue()
+            
+            while remaining is None or remaining > 0:
+                size = self.export_batch_size if remaining is None else min(remaining, self.export_batch_size)
+                if after is None:
+                    rows = conn.execute(f"{select} ORDER BY {key} LIMIT ?", (size,)).fetchall()
+                else:
+                    rows = conn.execute(f"{select} WHERE {key} > ? ORDER BY {key} LIMIT ?", (after, size)).fetchall()
+                if not rows:
+                    break
+                
+                if fmt == 'csv':
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows(
+                        [self.CSV_NULL if value is None else value for value in row] for row in rows
+                    )
+                    chunk = buffer.getvalue()
+                else:
+                    chunk = "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+                
+                after = rows[-1][columns.index(key)]
+                if remaining is not None:
+                    remaining -= len(rows)
+                metrics.inc('bulk_rows_total', len(rows), table=table, direction='export')
+                yield chunk
+                
+                if len(rows) < size:
+                    break
+        finally:
+            conn.close()
+    
+    def _parse(self, stream, fmt, position):
+        """Yield row dicts from a binary request stream
+        
+        position['line'] is kept at the line being parsed or last yielded,
+        so errors can be reported against it.
+        """
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='' if fmt == 'csv' else None)
+        if fmt == 'csv':
+            reader = csv.DictReader(text, strict=True)
+            try:
+                for row in reader:
+                    position['line'] = reader.line_num
+                    if None in row or None in row.values():
+                        raise ValueError(f"expected {len(reader.fieldnames)} fields like the header")
+                    yield {k: (None if v == self.CSV_NULL else v) for k, v in row.items()}
+            except csv.Error as e:
+                # DictReader.line_num is only updated for rows that parsed
+                position['line'] = reader.reader.line_num
+                raise ValueError(f"invalid CSV ({e})")
+        else:
+            for number, line in enumerate(text, start=1):
+                position['line'] = number
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    raise ValueError("invalid JSON")
+                if not isinstance(row, dict):
+                    raise ValueError("expected an object")
+                yield row
+    
+    def import_rows(self, table, stream, fmt='ndjson'):
+        """Upsert rows from a stream in large batched transactions
+        
+        The first bad row stops the import; the result then carries its
+        line and error, and `imported` counts the rows of batches already
+        committed before it.
+        """
+        key = self.TABLES[table]
+        known = set(self.table_columns(table))
+        columns = None
+        statement = None
+        batch = []
+        position = {'line': None}
+        result = {'table': table, 'imported': 0, 'batches': 0}
+        
+        def values():
+            # executemany pulls rows one at a time, so a failing statement
+            # leaves position at its line
+            for line, row in batch:
+                position['line'] = line
+                yield row
+        
+        def flush():
+            conn = self.db.connect()
+            try:
+                conn.begin_write()
+                conn.cursor().executemany(statement, values())
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            result['imported'] += len(batch)
+            result['batches'] += 1
+            metrics.inc('bulk_rows_total', len(batch), table=table, direction='import')
+            self.db.record_write(f"import_{table}")
+            batch.clear()
+        
+        try:
+            for row in self._parse(stream, fmt, position):
+                if columns is None:
+                    columns = list(row)
+                    unknown = set(columns) - known
+                    if unknown:
+                        raise ValueError(f"Unknown columns for {table}: {', '.join(sorted(unknown))}")
+                    if key not in columns:
+                        raise ValueError(f"Rows must include the key column {key}")
+                    updates = [c for c in columns if c != key]
+                    statement = (
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                        f"ON CONFLICT({key}) DO " +
+                        (f"UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in updates)}" if updates else "NOTHING")
+                    )
+                elif set(row) != set(columns):
+                    raise ValueError("columns differ from the first row")
+                if row[key] is None:
+                    raise ValueError(f"key column {key} is null")
+                
+                batch.append((position['line'], tuple(row[c] for c in columns)))
+                if len(batch) >= self.import_batch_size:
+                    flush()
+            
+            if batch:
+                flush()
+        except (ValueError, OverflowError, sqlite3.Error) as e:
+            # Bad values (nested JSON, out-of-range integers, constraint
+            # violations) only fail in SQLite; all are reported by line
+            result['line'] = position['line']
+            result['error'] = f"Line {position['line']}: {e}" if position['line'] else str(e)
+        return result
+
+# ==================== WAL SHIPPING ====================
+
+class WALShipper:
+    """Continuous replication of SQLite WAL frames to a backup store
+    
+    Layout in the store:
+        wal/<generation>/snapshot.db.z          full snapshot (zlib)
+        wal/<generation>/<seq>-<unix_ms>.seg    committed WAL frames (zlib)
+    
+    A generation starts with a snapshot; its segments replay on top of it
+    in sequence order. Restore picks the newest generation that started at
+    or before the target time and applies segments up to that time.
+    
+    Frames captured while uploads fail are coalesced into one segment on
+    the next successful flush. Past WAL_PENDING_MAX_BYTES they are dropped
+    and a new generation is started instead. Generations no longer needed
+    to restore within WAL_RETENTION_HOURS are pruned after each snapshot.
+    """
+    
+    WAL_HEADER_SIZE = 32
+    FRAME_HEADER_SIZE = 24
+    SEGMENT_MAGIC = b'MBWL'
+    SNAPSHOT_NAME = 'snapshot.db.z'
+    
+    def __init__(self, db, store):
+        self.db = db
+        self.store = store
+        self.wal_path = f"{db.db_path}-wal"
+        self.interval = WAL_SHIP_INTERVAL
+        self.snapshot_interval = WAL_SNAPSHOT_INTERVAL
+        self.checkpoint_bytes = WAL_CHECKPOINT_BYTES
+        self.lock = Lock()
+        self.conn = None
+        self.checkpoint_conn = None
+        self.generation = None
+        self.seq = 0
+        self.salt = None
+        self.offset = self.WAL_HEADER_SIZE
+        self.page_size = None
+        self.max_pending_bytes = WAL_PENDING_MAX_BYTES
+        self.retention = WAL_RETENTION_HOURS * 3600
+        self.pending_snapshot = None
+        self.pending_frames = []
+        self.pending_bytes = 0
+        self.needs_snapshot = False
+        self.last_snapshot = 0
+        self.last_ship = None
+        self.segments_shipped = 0
+    
+    def start(self):
+        """Take the initial snapshot; the scheduler calls tick() from then on"""
+        # Long-lived connections keep the WAL from being checkpointed and
+        # deleted when the last request connection closes
+        self.conn = self.db.connect()
+        self.checkpoint_conn = self.db.connect()
+        self.snapshot()
+        print(f"✅ WAL shipping every {self.interval}s (generation {self.generation})")
+    
+    def stop(self):
+        """Ship whatever is left; False if it could not be uploaded"""
+        return self.ship()
+    
+    def tick(self):
+        """Ship new frames, or start a new generation when a snapshot is due"""
+        if self.needs_snapshot or time.time() - self.last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+        else:
+            self.ship()
+    
+    def _read_frames(self):
+        """Read newly committed frames; caller must hold the write lock"""
+        try:
+            f = open(self.wal_path, 'rb')
+        except FileNotFoundError:
+            return b''
+        
+        with f:
+            header = f.read(self.WAL_HEADER_SIZE)
+            if len(header) < self.WAL_HEADER_SIZE:
+                return b''
+            page_size = struct.unpack('>I', header[8:12])[0]
+            self.page_size = 65536 if page_size == 1 else page_size
+            salt = header[16:24]
+            if salt != self.salt:
+                # The WAL was restarted after a checkpoint
+                self.salt = salt
+                self.offset = self.WAL_HEADER_SIZE
+            
+            frame_size = self.FRAME_HEADER_SIZE + self.page_size
+            f.seek(self.offset)
+            chunks = []
+            committed = 0
+            while True:
+                frame = f.read(frame_size)
+                if len(frame) < frame_size or frame[8:16] != salt:
+                    break
+                chunks.append(frame)
+                if struct.unpack('>I', frame[4:8])[0]:
+                    committed = len(chunks)
+        
+        self.offset += committed * frame_size
+        return b''.join(chunks[:committed])
+    
+    def _queue_frames(self, frames):
+        """Hold captured frames until the next flush, within the memory cap"""
+        self.pending_frames.append((int(time.time() * 1000), frames))
+        self.pending_bytes += len(frames)
+        if self.pending_bytes > self.max_pending_bytes:
+            # The next snapshot covers these frames; only point-in-time
+            # granularity since the last upload is lost
+            print(f"⚠️ {self.pending_bytes} bytes of WAL frames unshipped; dropping them for a new snapshot")
+            self._drop_frames()
+            self.needs_snapshot = True
+    
+    def _drop_frames(self):
+        self.pending_frames = []
+        self.pending_bytes = 0
+    
+    def _flush(self):
+        """Upload the pending snapshot, then all pending frames as one segment"""
+        if self.pending_snapshot:
+            name, body = self.pending_snapshot
+            if not self.store.put_large(name, body, f"🧾 WAL: {name}"):
+                return False
+            self.pending_snapshot = None
+            self.last_ship = datetime.now()
+            self._prune()
+        
+        if self.pending_frames:
+            seq = self.seq + 1
+            # Stamped with the last capture, so no frame is newer than its name says
+            name = f"wal/{self.generation}/{seq:010d}-{self.pending_frames[-1][0]}.seg"
+            frames = b''.join(chunk for _, chunk in self.pending_frames)
+            body = self.SEGMENT_MAGIC + struct.pack('>I', self.page_size) + zlib.compress(frames)
+            if not self.store.put_object(name, body, f"🧾 WAL: {name}"):
+                return False
+            self.seq = seq
+            self._drop_frames()
+            self.segments_shipped += 1
+            metrics.inc('wal_segments_shipped_total')
+            metrics.observe('wal_segment_bytes', len(body), buckets=Metrics.SIZE_BUCKETS)
+            self.last_ship = datetime.now()
+        return True
+    
+    def _prune(self):
+        """Delete generations that no restore point inside the retention window needs"""
+        generations = self.store.list_objects('wal')
+        if generations is None:
+            return
+        cutoff = (time.time() - self.retention) * 1000
+        generations = sorted(g for g in generations if g != self.generation)
+        newer_started = [int(g.split('-')[0]) for g in generations[1:]] + [int(self.generation.split('-')[0])]
+        expired = [g for g, started in zip(generations, newer_started) if started <= cutoff]
+        if expired and self.store.delete_objects([f"wal/{g}" for g in expired]):
+            print(f"🧹 Pruned {len(expired)} WAL generations")
+    
+    def ship(self):
+        """Capture committed frames since the last ship and upload them"""
+        with self.lock:
+            start = time.perf_counter()
+            self.conn.begin_write()
+            try:
+                frames = self._read_frames()
+                if frames:
+                    self._queue_frames(frames)
+                if self.offset >= self.checkpoint_bytes:
+                    # Writers are blocked, so every frame being folded into
+                    # the database has already been captured
+                    self.checkpoint_conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            finally:
+                self.conn.rollback()
+                metrics.observe('wal_capture_seconds', time.perf_counter() - start)
+            return self._flush()
+    
+    def snapshot(self):
+        """Start a new generation from a full snapshot"""
+        with self.lock:
+            # Writers are blocked only while the WAL position is recorded
+            # and a read transaction is pinned at it
+            self.conn.begin_write()
+            try:
+                frames = self._read_frames()
+                if frames and self.generation:
+                    self._queue_frames(frames)
+                self.checkpoint_conn.execute("BEGIN")
+                self.checkpoint_conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+                generation = f"{int(time.time() * 1000):013d}-{secrets.token_hex(3)}"
+            except Exception:
+                self.checkpoint_conn.rollback()
+                raise
+            finally:
+                self.conn.rollback()
+            
+            # The copy reads the pinned snapshot while writers carry on;
+            # their frames land after the recorded offset, in the new generation
+            try:
+                content = self.db.snapshot_bytes(self.checkpoint_conn)
+            finally:
+                self.checkpoint_conn.rollback()
+            
+            # Finish the old generation if possible; the snapshot covers
+            # anything that could not be uploaded
+            if self.generation and not self.pending_snapshot:
+                self._flush()
+            self._drop_frames()
+            self.generation = generation
+            self.seq = 0
+            self.pending_snapshot = (f"wal/{generation}/{self.SNAPSHOT_NAME}", zlib.compress(content))
+            self.needs_snapshot = False
+            self.last_snapshot = time.time()
+            return self._flush()
+    
+    @classmethod
+    def _apply_segment(cls, f, body):
+        """Write a segment's frames into an open database file"""
+        if body[:4] != cls.SEGMENT_MAGIC:
+            raise ValueError("Not a WAL segment")
+        page_size = struct.unpack('>I', body[4:8])[0]
+        frames = zlib.decompress(body[8:])
+        frame_size = cls.FRAME_HEADER_SIZE + page_size
+        for pos in range(0, len(frames), frame_size):
+            page_number, db_pages = struct.unpack('>II', frames[pos:pos + 8])
+            f.seek((page_number - 1) * page_size)
+            f.write(frames[pos + cls.FRAME_HEADER_SIZE:pos + frame_size])
+            if db_pages:
+                f.truncate(db_pages * page_size)
+    
+    def restore(self, dest_path, target_time=None):
+        """Rebuild the database at dest_path as of target_time (default: latest)"""
+        cutoff = int(target_time.timestamp() * 1000) if target_time else None
+        generations = self.store.list_objects('wal')
+        if generations is None:
+            raise BackupStoreUnavailable("Could not list WAL generations")
+        
+        for generation in sorted(generations, reverse=True):
+            started = int(generation.split('-')[0])
+            if cutoff is not None and started > cutoff:
+                continue
+            names = self.store.list_objects(f"wal/{generation}")
+            if names is None:
+                raise BackupStoreUnavailable(f"Could not list WAL generation {generation}")
+            if self.SNAPSHOT_NAME not in names:
+                continue
+            snapshot = self.store.get_large(f"wal/{generation}/{self.SNAPSHOT_NAME}")
+            if snapshot is None:
+                raise BackupStoreUnavailable(f"Could not download the snapshot of WAL generation {generation}")
+            
+            tmp_path = f"{dest_path}.restore"
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.decompress(snapshot))
+            
+            applied = 0
+            restored_to = started
+            with open(tmp_path, 'r+b') as f:
+                for name in sorted(n for n in names if n.endswith('.seg')):
+                    seq, stamp = (int(part) for part in name[:-4].split('-'))
+                    if seq != applied + 1:
+                        print(f"⚠️ WAL segment gap before {name}; stopping replay")
+                        break
+                    if cutoff is not None and stamp > cutoff:
+                        break
+                    body = self.store.get_object(f"wal/{generation}/{name}")
+                    if body is None:
+                        os.remove(tmp_path)
+                        raise BackupStoreUnavailable(f"Could not download WAL segment {name}")
+                    self._apply_segment(f, body)
+                    applied += 1
+                    restored_to = stamp
+            
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(dest_path + suffix):
+                    os.remove(dest_path + suffix)
+            os.replace(tmp_path, dest_path)
+            return {
+                'generation': generation,
+                'segments': applied,
+                'restored_to': datetime.fromtimestamp(restored_to / 1000).isoformat()
+            }
+        
+        return None
+    
+    def status(self):
+        return {
+            'generation': self.generation,
+            'segments_shipped': self.segments_shipped,
+            'pending_uploads': len(self.pending_frames) + (1 if self.pending_snapshot else 0),
+            'pending_bytes': self.pending_bytes,
+            'last_ship': self.last_ship.isoformat() if self.last_ship else None
+        }
+
+# ==================== TENANT SHARDS ====================
+
+class TenantShard:
+    """Open connection to one tenant's database"""
+    
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS bot_users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            message_count INTEGER DEFAULT 0,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS bot_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            kind TEXT,
+            payload TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    ]
+    
+    def __init__(self, tenant_id, path):
+        self.tenant_id = tenant_id
+        self.path = path
+        self.lock = Lock()
+        self.in_use = 0
+        self.evicted = False
+        self.last_used = time.monotonic()
+        self.conn = sqlite3.connect(path, check_same_thread=False, factory=InstrumentedConnection)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+    
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception as e:
+            print(f"⚠️ Shard {self.tenant_id} close error: {e}")
+
+class ShardManager:
+    """Per-tenant SQLite databases for hosted child-bot data
+    
+    The master database keeps users, user_bots and star_payments; each child
+    bot's own data lives in SHARD_DIR/<bot_id>.db. Open connections sit in
+    an LRU of SHARD_CACHE_SIZE; evicted shards are closed once no thread is
+    using them. Written shards are marked dirty, and maintain() (run by the
+    scheduler every SHARD_BACKUP_INTERVAL seconds) overwrites their
+    shards/<bot_id>.db backups, batching up to BATCH_BYTES of shards into
+    one upload (one commit on GitHub).
+    """
+    
+    BATCH_BYTES = 32 * 1024 * 1024
+    
+    def __init__(self, store):
+        self.store = store
+        self.shard_dir = os.path.abspath(SHARD_DIR)
+        self.max_open = SHARD_CACHE_SIZE
+        self.open = OrderedDict()
+        self.opening = {}
+        self.dirty = set()
+        self.backups = None
+        self.legacy_backups = None
+        self.lock = Lock()
+        os.makedirs(self.shard_dir, exist_ok=True)
+    
+    @staticmethod
+    def tenant_for(bot_token):
+        """Tenant id for a bot token: the numeric bot id"""
+        tenant_id = bot_token.split(':', 1)[0]
+        if not tenant_id.isdigit():
+            raise ValueError("Malformed bot token")
+        return tenant_id
+    
+    def _path(self, tenant_id):
+        return os.path.join(self.shard_dir, f"{tenant_id}.db")
+    
+    def start(self):
+        print(f"✅ Tenant shards: {self.shard_dir} (max {self.max_open} open)")
+    
+    def stop(self):
+        self.backup_dirty()
+        self.close_all()
+    
+    def maintain(self):
+        """Back up dirty shards and close idle ones"""
+        self.backup_dirty()
+        self.close_idle(SHARD_IDLE_SECONDS)
+    
+    @contextmanager
+    def connection(self, tenant_id, write=False):
+        """Exclusive use of a tenant's connection; commits are up to the caller"""
+        shard = self._acquire(tenant_id)
+        try:
+            with shard.lock:
+                try:
+                    yield shard.conn
+                except Exception:
+                    shard.conn.rollback()
+                    raise
+                if write:
+                    with self.lock:
+                        self.dirty.add(tenant_id)
+        finally:
+            self._release(shard)
+    
+    def _checkout_locked(self, tenant_id):
+        shard = self.open.get(tenant_id)
+        if shard:
+            self.open.move_to_end(tenant_id)
+            shard.in_use += 1
+        return shard
+    
+    def _acquire(self, tenant_id):
+        with self.lock:
+            shard = self._checkout_locked(tenant_id)
+            if shard:
+                return shard
+            opening = self.opening.setdefault(tenant_id, Lock())
+        
+        # Open (and possibly restore) outside the global lock so one slow
+        # tenant doesn't block the others
+        with opening:
+            with self.lock:
+                shard = self._checkout_locked(tenant_id)
+                if shard:
+                    return shard
+            
+            path = self._path(tenant_id)
+            if not os.path.exists(path):
+                self._restore(tenant_id, path)
+            shard = TenantShard(tenant_id, path)
+            
+            with self.lock:
+                shard.in_use = 1
+                self.open[tenant_id] = shard
+                self.opening.pop(tenant_id, None)
+                self._evict_locked()
+                metrics.gauge_add('shards_open', 1)
+            return shard
+    
+    def _release(self, shard):
+        with self.lock:
+            shard.in_use -= 1
+            shard.last_used = time.monotonic()
+            close = shard.evicted and shard.in_use == 0
+        if close:
+            shard.close()
+    
+    def _evict_locked(self):
+        while len(self.open) > self.max_open:
+            _, victim = self.open.popitem(last=False)
+            self._retire_locked(victim)
+            metrics.inc('shard_evictions_total')
+    
+    def _retire_locked(self, shard):
+        """Drop a shard from the LRU; it closes now or when its last user releases it"""
+        shard.evicted = True
+        metrics.gauge_add('shards_open', -1)
+        if shard.in_use == 0:
+            shard.close()
+    
+    def close_idle(self, max_idle):
+        """Close shards nobody has used for max_idle seconds"""
+        cutoff = time.monotonic() - max_idle
+        with self.lock:
+            idle = [t for t, shard in self.open.items() if shard.in_use == 0 and shard.last_used < cutoff]
+            for tenant_id in idle:
+                self._retire_locked(self.open.pop(tenant_id))
+        return len(idle)
+    
+    def close(self, tenant_id):
+        """Close one tenant's shard if it is open"""
+        with self.lock:
+            shard = self.open.pop(tenant_id, None)
+            if shard:
+                self._retire_locked(shard)
+        return shard is not None
+    
+    def close_all(self):
+        with self.lock:
+            while self.open:
+                self._retire_locked(self.open.popitem()[1])
+    
+    def _load_backup_index(self):
+        """Which tenants have a backup, listed once per process
+        
+        Raises BackupStoreUnavailable rather than let a tenant with a
+        backup start from an empty shard that would later overwrite it.
+        """
+        if self.backups is None:
+            names = self.store.list_objects('shards')
+            if names is None:
+                raise BackupStoreUnavailable("Could not list shard backups")
+            backups, legacy = set(), set()
+            for name in names:
+                if name.endswith('.db') or name.endswith('.db.manifest'):
+                    backups.add(name.split('.', 1)[0])
+                elif name.isdigit():
+                    # shards/<bot_id>/<unix_ms>.db from before backups were overwritten in place
+                    legacy.add(name)
+            self.backups, self.legacy_backups = backups, legacy
+        return self.backups, self.legacy_backups
+    
+    def _restore(self, tenant_id, path):
+        """Fetch a tenant's backup if it has one"""
+        backups, legacy = self._load_backup_index()
+        if tenant_id in backups:
+            name = f"shards/{tenant_id}.db"
+        elif tenant_id in legacy:
+            latest = self.store.get_latest_backup(f"shards/{tenant_id}")
+            if not latest:
+                return False
+            name = f"shards/{tenant_id}/{latest['name']}"
+        else:
+            return False
+        content = self.store.restore_backup(name)
+        if not content:
+            raise BackupStoreUnavailable(f"Could not download {name}")
+        tmp_path = f"{path}.restore"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        print(f"✅ Restored shard {tenant_id} from {name}")
+        return True
+    
+    def _mark_dirty(self, tenants):
+        with self.lock:
+            self.dirty.update(tenants)
+    
+    def _snapshot(self, tenant_id):
+        try:
+            with self.connection(tenant_id) as conn:
+                return sqlite_snapshot(conn)
+        except Exception as e:
+            print(f"❌ Shard {tenant_id} snapshot error: {e}")
+            metrics.inc('shard_backups_total', result='error')
+            self._mark_dirty([tenant_id])
+            return None
+    
+    def _upload(self, batch):
+        """Overwrite the backups of a batch of shards in one upload"""
+        if not self.store.put_objects({f"shards/{t}.db": content for t, content in batch.items()},
+                                      f"🗂️ Shard backup: {len(batch)} tenants"):
+            print(f"❌ Shard backup of {len(batch)} tenants failed; retrying next pass")
+            metrics.inc('shard_backups_total', len(batch), result='error')
+            self._mark_dirty(batch)
+            return 0
+        for content in batch.values():
+            metrics.observe('shard_backup_bytes', len(content), buckets=Metrics.SIZE_BUCKETS)
+        metrics.inc('shard_backups_total', len(batch), result='ok')
+        
+        try:
+            backups, legacy_backups = self._load_backup_index()
+        except BackupStoreUnavailable:
+            return len(batch)
+        backups.update(batch)
+        # Old timestamped copies are superseded once the tenant's new backup exists
+        legacy = legacy_backups & set(batch)
+        if legacy and self.store.delete_objects([f"shards/{t}" for t in sorted(legacy)]):
+            legacy_backups -= legacy
+        return len(batch)
+    
+    def backup_dirty(self):
+        """Back up every shard written since its last backup"""
+        with self.lock:
+            tenants = sorted(self.dirty)
+            self.dirty.clear()
+        if not tenants:
+            return 0
+        
+        uploaded = 0
+        batch, batch_bytes = {}, 0
+        step = BACKUP_PARALLELISM * 4
+        with ThreadPoolExecutor(max_workers=BACKUP_PARALLELISM) as pool:
+            for i in range(0, len(tenants), step):
+                chunk = tenants[i:i + step]
+                for tenant_id, content in zip(chunk, pool.map(self._snapshot, chunk)):
+                    if content is None:
+                        continue
+                    batch[tenant_id] = content
+                    batch_bytes += len(content)
+                if batch_bytes >= self.BATCH_BYTES:
+                    uploaded += self._upload(batch)
+                    batch, batch_bytes = {}, 0
+        if batch:
+            uploaded += self._upload(batch)
+        return uploaded
+    
+    def status(self):
+        with self.lock:
+            return {'open': len(self.open), 'dirty': len(self.dirty), 'max_open': self.max_open}
+
+# ==================== BOT PROVISIONING ====================
+
+class TTLCache:
+    """Thread-safe cache whose entries expire after a fixed time"""
+    
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.data = {}
+        self.lock = Lock()
+    
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self.data[key]
+                return default
+            return entry[1]
+    
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            if key not in self.data and len(self.data) >= self.max_size:
+                self._purge_locked()
+                if len(self.data) >= self.max_size:
+                    # Drop the oldest insertion
+                    del self.data[next(iter(self.data))]
+            self.data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+    
+    def pop(self, key):
+        with self.lock:
+            entry = self.data.pop(key, None)
+            return entry[1] if entry else None
+    
+    def _purge_locked(self):
+        now = time.monotonic()
+        expired = [key for key, (expires, _) in self.data.items() if expires <= now]
+        for key in expired:
+            del self.data[key]
+        return len(expired)
+    
+    def purge(self):
+        """Drop expired entries; returns how many were removed"""
+        with self.lock:
+            return self._purge_locked()
+    
+    def __len__(self):
+        return len(self.data)
+
+class ProvisioningError(Exception):
+    """Provisioning failure that retrying will not fix"""
+
+class ProvisioningPipeline:
+    """Persistent job pipeline that provisions child bots off the update thread
+    
+    Stages: verify (getMe) -> reserve (charge stars, insert inactive bot)
+    -> webhook (setWebhook) -> confirm (activate, notify). Each stage is
+    retried with backoff up to PROVISION_MAX_ATTEMPTS; a job that fails
+    after reserving is refunded. Jobs survive restarts in provision_jobs.
+    """
+    
+    BOT_PRICE = 100
+    STAGES = ('verify', 'reserve', 'webhook', 'confirm')
+    
+    def __init__(self, bot):
+        self.bot = bot
+        self.db = bot.db
+        self.workers = PROVISION_WORKERS
+        self.max_attempts = PROVISION_MAX_ATTEMPTS
+        self.token_cache = TTLCache(TOKEN_CACHE_TTL)
+        self.queue = queue.Queue()
+        self.threads = []
+    
+    def start(self):
+        """Start workers and resume unfinished jobs"""
+        for i in range(self.workers):
+            thread = Thread(target=self._worker, name=f"provision-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        
+        conn = self.db.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE provision_jobs SET status = 'pending' WHERE status = 'running'")
+            conn.commit()
+            cursor.execute("SELECT job_id FROM provision_jobs WHERE status = 'pending' ORDER BY created_at")
+            pending = [row[0] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+        
+        for job_id in pending:
+            self.queue.put(job_id)
+        print(f"✅ Provisioning: {self.workers} workers, {len(pending)} jobs resumed")
+    
+    def submit(self, user_id, chat_id, bot_token):
+        """Persist a job and queue it; returns the job id, or None if one is already running"""
+        job_id = f"job_{secrets.token_hex(6)}"
+        conn = self.db.connect()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT 1 FROM provision_jobs WHERE bot_token = ? AND status IN ('pending', 'running')",
+                (bot_token,)
             )
-        ''')
+            if cursor.fetchone():
+                conn.rollback()
+                return None
+            cursor.execute(
+                '''
+                INSERT INTO provision_jobs (job_id, user_id, chat_id, bot_token, price)
+                VALUES (?, ?, ?, ?, ?)
+                ''',
+                (job_id, user_id, chat_id, bot_token, self.BOT_PRICE)
+            )
+            conn.commit()
+        finally:
+            conn.close()
         
-        conn.commit()
-        conn.close()
-        print("✅ Database setup complete")
+        self.db.record_write("provision_submit")
+        self.queue.put(job_id)
+        return job_id
     
-    def execute_with_backup(self, query, params=(), user_id=None, action=None):
-        """Execute query with auto-backup check"""
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        cursor = conn.cursor()
+    def verify_token(self, bot_token):
+        """getMe through the token cache; returns bot info, or None for a rejected token"""
+        cached = self.token_cache.get(bot_token)
+        if cached is not None:
+            metrics.inc('token_cache_total', result='hit')
+            return cached or None
+        metrics.inc('token_cache_total', result='miss')
+        
+        response = telegram_request(bot_token, 'getMe', 'GET', timeout=10)
+        if response.status_code in (401, 404):
+            # Cache rejections briefly so bulk retries don't hammer getMe
+            self.token_cache.set(bot_token, False, ttl=min(60, self.token_cache.ttl))
+            return None
+        data = response.json()
+        if not data.get('ok'):
+            raise RuntimeError(data.get('description', f"getMe failed: {response.status_code}"))
+        self.token_cache.set(bot_token, data['result'])
+        return data['result']
+    
+    def _worker(self):
+        while True:
+            job_id = self.queue.get()
+            try:
+                self._process(job_id)
+            except Exception as e:
+                print(f"❌ Provisioning worker error ({job_id}): {e}")
+            finally:
+                self.queue.task_done()
+    
+    def _load(self, job_id):
+        conn = self.db.connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM provision_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+    
+    def _update(self, job_id, cursor=None, **fields):
+        fields['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        query = f"UPDATE provision_jobs SET {assignments} WHERE job_id = ?"
+        params = tuple(fields.values()) + (job_id,)
+        if cursor is not None:
+            cursor.execute(query, params)
+            return
+        conn = self.db.connect()
+        try:
+            conn.begin_write()
+            conn.cursor().execute(query, params)
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def _process(self, job_id):
+        job = self._load(job_id)
+        if not job or job['status'] not in ('pending', 'running'):
+            return
         
+        stage = job['stage']
+        self._update(job_id, status='running')
+        start = time.perf_counter()
+        outcome = 'ok'
         try:
-            if isinstance(query, str):
-                cursor.execute(query, params)
+            next_stage = getattr(self, f"_stage_{stage}")(job)
+        except ProvisioningError as e:
+            outcome = 'failed'
+            self._fail(job, str(e))
+        except Exception as e:
+            attempts = job['attempts'] + 1
+            if attempts >= self.max_attempts:
+                outcome = 'failed'
+                self._fail(job, f"{stage} failed after {attempts} attempts: {e}")
             else:
-                cursor.executescript(query)
+                outcome = 'retry'
+                delay = 2 ** attempts
+                print(f"⚠️ Provisioning {job_id} {stage} attempt {attempts} failed, retrying in {delay}s: {e}")
+                self._update(job_id, status='pending', attempts=attempts, last_error=str(e)[:500])
+                timer = threading.Timer(delay, self.queue.put, args=(job_id,))
+                timer.daemon = True
+                timer.start()
+        else:
+            if next_stage == 'done':
+                self._update(job_id, stage='done', status='done', last_error=None)
+                metrics.inc('provision_jobs_total', result='done')
+            else:
+                self._update(job_id, stage=next_stage, status='pending', attempts=0)
+                self.queue.put(job_id)
+        finally:
+            metrics.observe('provision_stage_seconds', time.perf_counter() - start, stage=stage, outcome=outcome)
+    
+    def _stage_verify(self, job):
+        bot_info = self.verify_token(job['bot_token'])
+        if not bot_info:
+            raise ProvisioningError("Invalid bot token")
+        self._update(job['job_id'], bot_username=bot_info['username'])
+        return 'reserve'
+    
+    def _stage_reserve(self, job):
+        """Charge stars and insert the (inactive) bot in one transaction"""
+        conn = self.db.connect()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            cursor.execute("SELECT stars FROM users WHERE user_id = ?", (job['user_id'],))
+            user = cursor.fetchone()
+            if not user:
+                raise ProvisioningError("User not found. Send /start first.")
+            if user[0] < job['price']:
+                raise ProvisioningError(
+                    f"Insufficient stars\nRequired: {job['price']} stars\nYour balance: {user[0]} stars")
+            cursor.execute("SELECT 1 FROM user_bots WHERE bot_token = ?", (job['bot_token'][:50],))
+            if cursor.fetchone():
+                raise ProvisioningError("This bot is already registered")
             
+            cursor.execute(
+                '''
+                INSERT INTO user_bots (bot_token, bot_username, owner_id, is_active)
+                VALUES (?, ?, ?, 0)
+                ''',
+                (job['bot_token'][:50], job['bot_username'], job['user_id'])
+            )
+            cursor.execute(
+                "UPDATE users SET stars = stars - ? WHERE user_id = ?",
+                (job['price'], job['user_id'])
+            )
+            cursor.execute(
+                "INSERT INTO activity_logs (user_id, action, details) VALUES (?, ?, ?)",
+                (job['user_id'], "reserve_bot", json.dumps([job['job_id'], job['bot_username'], job['price']]))
+            )
+            # Advancing the stage in the same transaction keeps retries from charging twice
+            self._update(job['job_id'], cursor=cursor, stage='webhook', attempts=0)
             conn.commit()
-            self.process_count += 1
-            
-            # Log activity
-            if user_id and action:
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        self.db.record_write("reserve_bot")
+        return 'webhook'
+    
+    def _stage_webhook(self, job):
+        webhook_url = f"{WEBHOOK_URL}/webhook/{job['bot_token']}"
+        response = telegram_request(job['bot_token'], 'setWebhook', json={'url': webhook_url}, timeout=10)
+        if response.status_code == 401:
+            self.token_cache.pop(job['bot_token'])
+            raise ProvisioningError("Bot token was revoked")
+        if not response.json().get('ok'):
+            raise RuntimeError(response.json().get('description', f"setWebhook failed: {response.status_code}"))
+        return 'confirm'
+    
+    def _stage_confirm(self, job):
+        conn = self.db.connect()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE user_bots SET is_active = 1 WHERE bot_token = ? AND owner_id = ?",
+                (job['bot_token'][:50], job['user_id'])
+            )
+            cursor.execute(
+                "INSERT INTO activity_logs (user_id, action, details) VALUES (?, ?, ?)",
+                (job['user_id'], "create_bot", json.dumps([job['job_id'], job['bot_username']]))
+            )
+            cursor.execute("SELECT stars FROM users WHERE user_id = ?", (job['user_id'],))
+            balance = cursor.fetchone()[0]
+            conn.commit()
+        finally:
+            conn.close()
+        
+        self.db.record_write("create_bot")
+        self.bot.hosted_tokens.pop(job['bot_token'])
+        self.bot.send_message(job['chat_id'], self.bot.bot_created_message(
+            job['bot_username'], job['price'], balance, f"{WEBHOOK_URL}/webhook/{job['bot_token']}"))
+        return 'done'
+    
+    def _fail(self, job, reason):
+        """Mark a job failed, refunding the reservation if one was made"""
+        refunded = False
+        conn = self.db.connect()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            if job['stage'] in ('webhook', 'confirm'):
                 cursor.execute(
-                    "INSERT INTO activity_logs (user_id, action, details) VALUES (?, ?, ?)",
-                    (user_id, action, json.dumps(params))
+                    "DELETE FROM user_bots WHERE bot_token = ? AND owner_id = ? AND is_active = 0",
+                    (job['bot_token'][:50], job['user_id'])
                 )
-                conn.commit()
-            
-            # Check if backup needed
-            if self.process_count >= self.backup_threshold:
-                self.create_backup(f"auto_after_{action}")
-                self.process_count = 0
+                if cursor.rowcount:
+                    cursor.execute(
+                        "UPDATE users SET stars = stars + ? WHERE user_id = ?",
+                        (job['price'], job['user_id'])
+                    )
+                    cursor.execute(
+                        "INSERT INTO activity_logs (user_id, action, details) VALUES (?, ?, ?)",
+                        (job['user_id'], "refund_bot", json.dumps([job['job_id'], job['price']]))
+                    )
+                    refunded = True
+            self._update(job['job_id'], cursor=cursor, status='failed', last_error=reason[:500])
+            conn.commit()
+        finally:
+            conn.close()
+        
+        self.db.record_write("provision_failed")
+        metrics.inc('provision_jobs_total', result='failed')
+        print(f"❌ Provisioning {job['job_id']} failed: {reason}")
+        self.bot.send_message(job['chat_id'],
+            f"❌ Could not create bot{' @' + job['bot_username'] if job['bot_username'] else ''}\n"
+            f"{reason}" + (f"\n\n💰 {job['price']} stars refunded" if refunded else ""))
+    
+    def status(self):
+        conn = self.db.connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM provision_jobs GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        return {
+            'queued': self.queue.qsize(),
+            'jobs': dict(rows),
+            'token_cache_size': len(self.token_cache)
+        }
+
+# ==================== WEBHOOK MONITOR ====================
+
+class RateLimiter:
+    """Spaces calls evenly at `rate` per second across threads"""
+    
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = Lock()
+    
+    def acquire(self, deadline=None):
+        """Wait for the next slot; False if it would land after deadline"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            if deadline is not None and slot > deadline:
+                return False
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+    
+    def pause(self, seconds):
+        """Hold every caller back, e.g. after a 429 with retry_after"""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+class WebhookMonitor:
+    """Periodic getWebhookInfo sweep over active hosted bots
+    
+    Bots are walked in token order, BATCH_SIZE at a time, with at most
+    WEBHOOK_SWEEP_CONCURRENCY checks in flight and WEBHOOK_SWEEP_RATE calls
+    per second. A sweep stops at WEBHOOK_SWEEP_BUDGET seconds or on a 429,
+    and the next one resumes where it left off. Drifted webhooks are set again, revoked
+    tokens are deactivated in one transaction per batch, and each bot's
+    pending_update_count lands in bot_health.
+    """
+    
+    BATCH_SIZE = 500
+    REVOKED_STATUS = (401, 404)
+    # Results that say nothing about the bot; the next sweep retries it
+    UNCHECKED = ('skipped', 'rate_limited')
+    
+    def __init__(self, bot):
+        self.bot = bot
+        self.db = bot.db
+        self.concurrency = WEBHOOK_SWEEP_CONCURRENCY
+        self.budget = WEBHOOK_SWEEP_BUDGET
+        self.limiter = RateLimiter(WEBHOOK_SWEEP_RATE)
+        self.cursor = ''
+        self.pending_total = 0
+        self.last_sweep = None
+    
+    def webhook_url(self, bot_token):
+        return f"{WEBHOOK_URL}/webhook/{bot_token}"
+    
+    def sweep(self):
+        """Check as many bots as the time budget allows"""
+        started = time.monotonic()
+        deadline = started + self.budget
+        counts = {}
+        complete = False
+        
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix='webhook-check') as pool:
+            while time.monotonic() < deadline:
+                tokens = self._next_batch()
+                if not tokens:
+                    complete = True
+                    break
+                results = list(pool.map(lambda token: self.check(token, deadline), tokens))
+                checked = [r for r in results if r[1] != 'skipped']
+                self._record(checked)
+                for _, result, _ in checked:
+                    counts[result] = counts.get(result, 0) + 1
+                unchecked = [i for i, r in enumerate(results) if r[1] in self.UNCHECKED]
+                if unchecked:
+                    # Resume from the first bot that did not fit in the budget
+                    # or was rate limited, so no bot is passed over
+                    if unchecked[0]:
+                        self.cursor = tokens[unchecked[0] - 1]
+                    break
+                self.cursor = tokens[-1]
+        
+        if complete:
+            self.cursor = ''
+        self._update_pending_gauge()
+        self.last_sweep = {
+            'finished_at': datetime.now().isoformat(),
+            'seconds': round(time.monotonic() - started, 2),
+            'complete': complete,
+            'results': counts
+        }
+        if counts.get('revoked') or counts.get('reregistered'):
+            print(f"🩺 Webhook sweep: {counts}")
+        return self.last_sweep
+    
+    def _next_batch(self):
+        conn = self.db.connect()
+        try:
+            rows = conn.execute(
+                "SELECT bot_token FROM user_bots WHERE is_active = 1 AND bot_token > ? ORDER BY bot_token LIMIT ?",
+                (self.cursor, self.BATCH_SIZE)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+    
+    def _call(self, bot_token, api_method, deadline, **kwargs):
+        if not self.limiter.acquire(deadline):
+            return None
+        response = telegram_request(bot_token, api_method, timeout=10, **kwargs)
+        if response.status_code == 429:
+            retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+            self.limiter.pause(retry_after)
+        return response
+    
+    def check(self, bot_token, deadline=None):
+        """Check one bot; returns (token, result, webhook info or None)"""
+        try:
+            response = self._call(bot_token, 'getWebhookInfo', deadline)
+            if response is None:
+                return bot_token, 'skipped', None
+            if response.status_code in self.REVOKED_STATUS:
+                return bot_token, 'revoked', None
+            if response.status_code == 429:
+                return bot_token, 'rate_limited', None
+            data = response.json()
+            if not data.get('ok'):
+                return bot_token, 'error', None
             
-            return cursor
+            info = data['result']
+            if info.get('url') == self.webhook_url(bot_token):
+                return bot_token, 'ok', info
             
+            response = self._call(bot_token, 'setWebhook', None, json={'url': self.webhook_url(bot_token)})
+            if response.status_code in self.REVOKED_STATUS:
+                return bot_token, 'revoked', None
+            if response.status_code == 429:
+                return bot_token, 'rate_limited', None
+            return bot_token, 'reregistered' if response.json().get('ok') else 'error', info
         except Exception as e:
+            print(f"⚠️ Webhook check error for bot {bot_token.split(':', 1)[0]}: {e}")
+            return bot_token, 'error', None
+    
+    def _record(self, results):
+        """Store health rows for a batch and deactivate revoked bots"""
+        health = [
+            (token, token.split(':', 1)[0], info.get('pending_update_count', 0),
+             info.get('last_error_date'), info.get('last_error_message'), result)
+            for token, result, info in results if info is not None
+        ]
+        revoked = [token for token, result, _ in results if result == 'revoked']
+        for _, result, _ in results:
+            metrics.inc('webhook_checks_total', result=result)
+        if not health and not revoked:
+            return
+        
+        conn = self.db.connect()
+        try:
+            conn.begin_write()
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO bot_health
+                    (bot_token, tenant_id, pending_update_count, last_error_date, last_error_message, status, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(bot_token) DO UPDATE SET
+                    pending_update_count = excluded.pending_update_count,
+                    last_error_date = excluded.last_error_date,
+                    last_error_message = excluded.last_error_message,
+                    status = excluded.status,
+                    checked_at = CURRENT_TIMESTAMP
+            ''', health)
+            cursor.executemany("UPDATE user_bots SET is_active = 0 WHERE bot_token = ?", [(t,) for t in revoked])
+            cursor.executemany('''
+                INSERT INTO bot_health (bot_token, tenant_id, pending_update_count, status, checked_at)
+                VALUES (?, ?, 0, 'revoked', CURRENT_TIMESTAMP)
+                ON CONFLICT(bot_token) DO UPDATE SET
+                    pending_update_count = 0, status = 'revoked', checked_at = CURRENT_TIMESTAMP
+            ''', [(t, t.split(':', 1)[0]) for t in revoked])
+            conn.commit()
+        except Exception:
             conn.rollback()
-            raise e
+            raise
+        finally:
+            conn.close()
+        
+        # Revoked bots stop holding caches and shard connections
+        for token in revoked:
+            self.bot.hosted_tokens.pop(token)
+            self.bot.provisioner.token_cache.pop(token)
+            self.bot.shards.close(ShardManager.tenant_for(token))
+        if revoked:
+            self.db.record_write("deactivate_bots")
+    
+    def _update_pending_gauge(self):
+        conn = self.db.connect()
+        try:
+            total = conn.execute('''
+                SELECT COALESCE(SUM(h.pending_update_count), 0) FROM bot_health h
+                JOIN user_bots b ON b.bot_token = h.bot_token WHERE b.is_active = 1
+            ''').fetchone()[0]
         finally:
             conn.close()
+        metrics.gauge_add('child_pending_updates', total - self.pending_total)
+        self.pending_total = total
     
-    def create_backup(self, reason="manual"):
-        """Create database backup"""
+    def status(self):
+        conn = self.db.connect()
+        try:
+            backlogged = conn.execute('''
+                SELECT h.tenant_id, b.bot_username, h.pending_update_count FROM bot_health h
+                JOIN user_bots b ON b.bot_token = h.bot_token
+                WHERE b.is_active = 1 AND h.pending_update_count > 0
+                ORDER BY h.pending_update_count DESC LIMIT 5
+            ''').fetchall()
+        finally:
+            conn.close()
+        return {
+            'last_sweep': self.last_sweep,
+            'resume_after_tenant': self.cursor.split(':', 1)[0] if self.cursor else None,
+            'pending_updates': self.pending_total,
+            'most_backlogged': [
+                {'tenant_id': tenant_id, 'bot_username': username, 'pending_update_count': pending}
+                for tenant_id, username, pending in backlogged
+            ]
+        }
+
+# ==================== SCHEDULER ====================
+
+class ScheduledJob:
+    """A periodic job and its run statistics"""
+    
+    def __init__(self, name, func, interval, jitter, cluster):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.cluster = cluster
+        self.running = False
+        self.next_run = None
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.runs = 0
+        self.failures = 0
+    
+    def delay(self):
+        """Seconds until the next run, spread by +/- jitter"""
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+class Scheduler:
+    """Single-thread heap scheduler for periodic maintenance jobs
+    
+    Due jobs are handed to a small worker pool so one slow job cannot hold
+    up the rest; a job that is still running when it comes due again is
+    skipped rather than overlapped. Cluster jobs first take a lease in the
+    backup store through a conditional write, so of all instances sharing
+    the store (e.g. old and new during a deploy) one runs each of them per
+    interval. Other jobs maintain this process's own database, which only
+    one process may use (DatabaseManager.lock_database).
+    """
+    
+    def __init__(self, store):
+        self.store = store
+        self.owner = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs = {}
+        self.heap = []
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.pool = ThreadPoolExecutor(SCHEDULER_WORKERS, thread_name_prefix='scheduler')
+        self.stopped = False
+        self.thread = None
+    
+    def add(self, name, func, interval, jitter=None, cluster=False):
+        """Run func every interval seconds; an interval <= 0 disables the job"""
+        if interval <= 0:
+            return None
+        job = ScheduledJob(name, func, interval, SCHEDULER_JITTER if jitter is None else jitter, cluster)
+        with self.condition:
+            self.jobs[name] = job
+            self._push_locked(job, time.time() + job.delay())
+        return job
+    
+    def _push_locked(self, job, when):
+        job.next_run = when
+        self.seq += 1
+        heapq.heappush(self.heap, (when, self.seq, job.name))
+        self.condition.notify()
+    
+    def start(self):
+        self.thread = Thread(target=self._run, name='scheduler', daemon=True)
+        self.thread.start()
+        print(f"✅ Scheduler: {len(self.jobs)} jobs ({', '.join(self.jobs)})")
+    
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+        # Don't wait out a long job (a webhook sweep can take minutes);
+        # the owners flush their own state on shutdown
+        self.pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.heap or self.heap[0][0] > time.time()):
+                    self.condition.wait(self.heap[0][0] - time.time() if self.heap else None)
+                if self.stopped:
+                    return
+                _, _, name = heapq.heappop(self.heap)
+                job = self.jobs[name]
+                self._push_locked(job, time.time() + job.delay())
+                if job.running:
+                    metrics.inc('scheduler_job_runs_total', job=name, result='overlap')
+                    continue
+                job.running = True
+            self.pool.submit(self._execute, job)
+    
+    def _execute(self, job):
         try:
-            with open(self.db_path, 'rb') as f:
-                db_content = f.read()
+            if job.cluster and not self._acquire_lease(job):
+                metrics.inc('scheduler_job_runs_total', job=job.name, result='leased')
+                return False
             
-            result = self.github_backup.create_backup(db_content, reason)
-            return result
-        except Exception as e:
-            print(f"❌ Create backup error: {e}")
-            return {"success": False, "error": str(e)}
+            started = time.perf_counter()
+            try:
+                job.func()
+                job.last_error = None
+                result = 'ok'
+            except Exception as e:
+                job.failures += 1
+                job.last_error = str(e)
+                result = 'error'
+                print(f"❌ Scheduled job {job.name} failed: {e}")
+            job.last_duration = time.perf_counter() - started
+            job.last_run = time.time()
+            job.runs += 1
+            metrics.observe('scheduler_job_seconds', job.last_duration, job=job.name)
+            metrics.inc('scheduler_job_runs_total', job=job.name, result=result)
+            return result == 'ok'
+        finally:
+            with self.condition:
+                job.running = False
     
-    def restore_latest(self):
-        """Restore from latest backup"""
+    def _acquire_lease(self, job):
+        """Claim the job's store lease for one interval; False if another instance holds it"""
         try:
-            latest = self.github_backup.get_latest_backup()
-            if latest:
-                db_content = self.github_backup.restore_backup(latest['name'])
-                if db_content:
-                    with open(self.db_path, 'wb') as f:
-                        f.write(db_content)
-                    print(f"✅ Restored from backup: {latest['name']}")
-                    return True
-            return False
+            return self.store.acquire_lease(job.name, self.owner, job.interval * (1 - job.jitter))
         except Exception as e:
-            print(f"❌ Restore error: {e}")
+            print(f"⚠️ Lease for {job.name} unavailable: {e}")
             return False
+    
+    def status(self):
+        return {
+            name: {
+                'interval': job.interval,
+                'running': job.running,
+                'next_run': datetime.fromtimestamp(job.next_run).isoformat() if job.next_run else None,
+                'last_run': datetime.fromtimestamp(job.last_run).isoformat() if job.last_run else None,
+                'last_duration': round(job.last_duration, 4) if job.last_duration is not None else None,
+                'last_error': job.last_error,
+                'runs': job.runs,
+                'failures': job.failures
+            }
+            for name, job in self.jobs.items()
+        }
 
 # ==================== MASTER BOT ====================
 
 class MasterBot:
     """Main Telegram bot with auto-backup"""
     
+    # Command names used as metric labels ("text" for plain messages,
+    # "unknown" for any other slash command)
+    COMMANDS = ('/start', '/help', '/backup', '/stats', '/mystats', '/addstars', '/createbot', '/env')
+    
     def __init__(self):
         self.token = BOT_TOKEN
-        self.base_url = f"https://api.telegram.org/bot{self.token}/"
+        self.base_url = f"{TELEGRAM_API_BASE}/bot{self.token}/"
         
         # Initialize systems
-        self.github_backup = GitHubAutoBackup()
-        self.db = DatabaseManager(self.github_backup)
+        self.backup_store = create_backup_store()
+        self.db = DatabaseManager(self.backup_store)
+        self.bulk = BulkTransfer(self.db)
+        self.wal_shipper = None
+        if WAL_SHIP_INTERVAL > 0:
+            self.wal_shipper = WALShipper(self.db, self.backup_store)
+            self.db.wal_shipper = self.wal_shipper
         
         # Recover from backup
         self.recover_from_backup()
         
+        # Continuous replication starts from the recovered state
+        if self.wal_shipper:
+            self.wal_shipper.start()
+        
+        # Hosted child bots keep their data in per-tenant shards
+        self.hosted_tokens = TTLCache(60)
+        self.shards = ShardManager(self.backup_store)
+        self.shards.start()
+        
+        # Child-bot provisioning runs off the update thread
+        self.provisioner = ProvisioningPipeline(self)
+        self.provisioner.start()
+        self.webhook_monitor = WebhookMonitor(self)
+        
+        # Periodic maintenance runs off the request path
+        self.scheduler = Scheduler(self.backup_store)
+        self.schedule_maintenance()
+        self.scheduler.start()
+        self.stopped = False
+        atexit.register(self.shutdown)
+        
         # Setup webhook
         self.setup_webhook()
         
         print("✅ Master Bot initialized")
     
+    def schedule_maintenance(self):
+        """Register periodic jobs; cluster jobs run on one instance per interval
+        
+        Jobs on this process's own database and shards always run here;
+        jobs acting on shared state (full backups in the store, the hosted
+        bots' webhooks) are cluster jobs.
+        """
+        if self.wal_shipper:
+            # Replication lag matters more than spreading load here
+            self.scheduler.add('wal_ship', self.wal_shipper.tick, self.wal_shipper.interval, jitter=0)
+        else:
+            self.scheduler.add('backup', lambda: self.db.create_backup("scheduled"), BACKUP_INTERVAL, cluster=True)
+        self.scheduler.add('shard_maintenance', self.shards.maintain, SHARD_BACKUP_INTERVAL)
+        self.scheduler.add('cache_purge', self.purge_caches, CACHE_PURGE_INTERVAL)
+        self.scheduler.add('activity_rollup', lambda: self.db.rollup_activity(ACTIVITY_RETENTION_DAYS),
+                           ACTIVITY_ROLLUP_INTERVAL)
+        self.scheduler.add('webhook_sweep', self.webhook_monitor.sweep, WEBHOOK_SWEEP_INTERVAL, cluster=True)
+        self.scheduler.add('analyze', self.db.analyze, ANALYZE_INTERVAL)
+        self.scheduler.add('vacuum', self.db.vacuum, VACUUM_INTERVAL)
+    
+    def shutdown(self):
+        """Flush unshipped WAL frames and dirty shards before the process exits"""
+        if self.stopped:
+            return
+        self.stopped = True
+        print("🛑 Shutting down: flushing WAL frames and tenant shards")
+        self.scheduler.stop()
+        if self.wal_shipper:
+            try:
+                if not self.wal_shipper.stop():
+                    print("❌ Final WAL ship failed; frames since the last ship are not in the store")
+            except Exception as e:
+                print(f"❌ Final WAL ship error: {e}")
+        try:
+            self.shards.stop()
+        except Exception as e:
+            print(f"❌ Final shard backup error: {e}")
+    
+    def purge_caches(self):
+        self.hosted_tokens.purge()
+        self.provisioner.token_cache.purge()
+    
     def recover_from_backup(self):
-        """Recover from GitHub backup on startup"""
+        """Recover from GitHub backup on startup
+        
+        A store that cannot be reached is retried and then aborts startup;
+        starting empty would ship a new WAL generation that hides the real
+        data from every later restore.
+        """
         print("🔄 Checking for GitHub backup...")
-        if self.db.restore_latest():
+        for attempt in range(1, RESTORE_ATTEMPTS + 1):
+            try:
+                restored = self.db.restore_latest()
+                break
+            except BackupStoreUnavailable as e:
+                if attempt == RESTORE_ATTEMPTS:
+                    print(f"❌ {e}; refusing to start with an empty database")
+                    raise
+                delay = min(2 ** attempt, 30)
+                print(f"⚠️ {e}; retrying in {delay}s ({attempt}/{RESTORE_ATTEMPTS})")
+                time.sleep(delay)
+        
+        if restored:
             print("✅ Recovered from GitHub backup")
         else:
             print("ℹ️ Starting with fresh database")
@@ -348,8 +3354,9 @@ class MasterBot:
         """Setup Telegram webhook"""
         try:
             webhook_url = f"{WEBHOOK_URL}/webhook/{self.token}"
-            response = requests.post(
-                f"{self.base_url}setWebhook",
+            response = telegram_request(
+                self.token,
+                'setWebhook',
                 json={'url': webhook_url},
                 timeout=10
             )
@@ -370,14 +3377,20 @@ class MasterBot:
                 'disable_web_page_preview': True
             }
             data.update(kwargs)
-            response = requests.post(f"{self.base_url}sendMessage", json=data, timeout=10)
+            response = telegram_request(self.token, 'sendMessage', json=data, timeout=10)
             return response.json()
         except Exception as e:
             print(f"❌ Send message error: {e}")
             return None
     
-    def process_update(self, update):
+    def process_update(self, update, received_at=None):
         """Process incoming update"""
+        if received_at is not None:
+            metrics.observe('webhook_to_handler_seconds', time.perf_counter() - received_at)
+        metrics.gauge_add('updates_in_flight', 1)
+        command = 'none'
+        start = time.perf_counter()
+        tracer.begin()
         try:
             if 'message' in update:
                 message = update['message']
@@ -394,6 +3407,9 @@ class MasterBot:
                 
                 if 'text' in message:
                     text = message['text']
+                    command = text.split()[0] if text.startswith('/') else 'text'
+                    if command != 'text' and command not in self.COMMANDS:
+                        command = 'unknown'
                     
                     if text == '/start':
                         self.handle_start(chat_id, user_id, first_name)
@@ -423,16 +3439,99 @@ class MasterBot:
                         self.send_message(chat_id, "❓ Unknown command. Use /help")
         
         except Exception as e:
+            metrics.inc('update_errors_total')
+            tracer.annotate(error=str(e))
             print(f"❌ Process error: {e}")
+        finally:
+            duration = time.perf_counter() - start
+            metrics.gauge_add('updates_in_flight', -1)
+            metrics.inc('updates_total')
+            metrics.observe('handler_duration_seconds', duration, command=command)
+            tracer.finish('process_update', duration, command=command, update_id=(update or {}).get('update_id'))
+    
+    def is_hosted_bot(self, bot_token):
+        """Whether a token belongs to an active hosted child bot"""
+        hosted = self.hosted_tokens.get(bot_token)
+        if hosted is None:
+            conn = self.db.connect()
+            try:
+                row = conn.execute(
+                    "SELECT 1 FROM user_bots WHERE bot_token = ? AND is_active = 1",
+                    (bot_token[:50],)
+                ).fetchone()
+            finally:
+                conn.close()
+            hosted = row is not None
+            self.hosted_tokens.set(bot_token, hosted)
+        return hosted
+    
+    def process_child_update(self, bot_token, update, received_at=None):
+        """Process an update for a hosted child bot against its tenant shard"""
+        if received_at is not None:
+            metrics.observe('webhook_to_handler_seconds', time.perf_counter() - received_at)
+        metrics.gauge_add('updates_in_flight', 1)
+        start = time.perf_counter()
+        tracer.begin()
+        try:
+            message = update.get('message')
+            if not message or 'from' not in message:
+                return
+            
+            tenant_id = ShardManager.tenant_for(bot_token)
+            user = message['from']
+            text = message.get('text', '')
+            
+            with self.shards.connection(tenant_id, write=True) as conn:
+                conn.execute(
+                    '''
+                    INSERT INTO bot_users (user_id, username, first_name, message_count)
+                    VALUES (?, ?, ?, 1)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        message_count = message_count + 1,
+                        last_seen = CURRENT_TIMESTAMP
+                    ''',
+                    (user['id'], user.get('username', ''), user.get('first_name', 'User'))
+                )
+                conn.execute(
+                    "INSERT INTO bot_events (user_id, kind, payload) VALUES (?, ?, ?)",
+                    (user['id'], 'message', text[:1000])
+                )
+                user_count = conn.execute("SELECT COUNT(*) FROM bot_users").fetchone()[0] if text == '/stats' else None
+                conn.commit()
+            
+            reply = None
+            if text == '/start':
+                reply = f"👋 Hello {user.get('first_name', 'User')}!\n\n🤖 This bot is hosted by the Auto-Backup Master Bot."
+            elif text == '/stats':
+                reply = f"📊 Users: {user_count}"
+            if reply:
+                telegram_request(bot_token, 'sendMessage', json={'chat_id': message['chat']['id'], 'text': reply}, timeout=10)
+        
+        except Exception as e:
+            metrics.inc('update_errors_total')
+            tracer.annotate(error=str(e))
+            print(f"❌ Child bot process error: {e}")
+        finally:
+            duration = time.perf_counter() - start
+            metrics.gauge_add('updates_in_flight', -1)
+            metrics.inc('updates_total')
+            metrics.observe('handler_duration_seconds', duration, command='child')
+            tracer.finish('process_child_update', duration, tenant_id=bot_token.split(':', 1)[0])
     
     def register_user(self, user_id, username, first_name):
         """Register or update user"""
         try:
             self.db.execute_with_backup(
                 '''
-                INSERT OR REPLACE INTO users 
+                INSERT INTO users 
                 (user_id, username, first_name, last_seen) 
                 VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_seen = CURRENT_TIMESTAMP
                 ''',
                 (user_id, username, first_name),
                 user_id=user_id,
@@ -476,6 +3575,12 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
         
         self.send_message(chat_id, message)
     
+    def backup_policy(self):
+        """One line on when changes reach the backup store"""
+        if self.wal_shipper:
+            return f"Ships changes (WAL segments) every {self.wal_shipper.interval:g}s"
+        return f"Backs up after every {self.db.backup_threshold} actions"
+    
     def handle_help(self, chat_id):
         """Handle /help command"""
         message = """🆘 *Bot Commands*
@@ -493,7 +3598,7 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
 /env - Environment info
 
 💾 *Auto-Backup System:*
-• Backs up after every 5 actions
+• {BACKUP_POLICY}
 • Manual backup with /backup
 • Auto-recover on restart
 • All data stored on GitHub
@@ -508,7 +3613,7 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
 3. Pay 100 stars
 4. Your bot is ready!
 
-❓ *Need help?* Contact the bot admin.""".format(STAR_PRICE=STAR_PRICE)
+❓ *Need help?* Contact the bot admin.""".format(STAR_PRICE=STAR_PRICE, BACKUP_POLICY=self.backup_policy())
         
         self.send_message(chat_id, message)
     
@@ -528,7 +3633,7 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
     
     def handle_stats(self, chat_id):
         """Handle /stats command"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.connect()
         cursor = conn.cursor()
         
         cursor.execute("SELECT COUNT(*) FROM users")
@@ -547,16 +3652,14 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
 👥 Users: {user_count}
 🤖 Active Bots: {bot_count}
 ⭐ Total Stars: {total_stars}
-💾 Backups Created: {self.github_backup.backup_count}
-🔄 Last Backup: {self.github_backup.last_backup.strftime('%Y-%m-%d %H:%M') if self.github_backup.last_backup else 'Never'}
+💾 Backups Created: {self.backup_store.backup_count}
+🔄 Last Backup: {self.backup_store.last_backup.strftime('%Y-%m-%d %H:%M') if self.backup_store.last_backup else 'Never'}
 
-🌐 *GitHub Backup:*
-• Repository: {GITHUB_REPO_NAME}
-• Path: {GITHUB_BACKUP_PATH}
-• Branch: {GITHUB_BACKUP_BRANCH}
+🌐 *Backup Store:*
+• {self.backup_store.describe()}
 
 ⚡ *Auto-Backup: ACTIVE*
-• Backup threshold: 5 actions
+• {self.backup_policy()}
 • Manual backup: /backup
 • Recovery on restart: ENABLED"""
         
@@ -564,7 +3667,7 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
     
     def handle_mystats(self, chat_id, user_id):
         """Handle /mystats command"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.connect()
         cursor = conn.cursor()
         
         cursor.execute(
@@ -653,89 +3756,57 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
         parts = text.split()
         if len(parts) < 2:
             self.send_message(chat_id, 
-                "Usage: /createbot YOUR_BOT_TOKEN\n\n"
+                "Usage: /createbot YOUR_BOT_TOKEN [MORE_TOKENS...]\n\n"
                 "Get token from @BotFather")
             return
         
-        bot_token = parts[1]
-        bot_price = 100  # Stars required
+        bot_tokens = list(dict.fromkeys(parts[1:]))
+        bot_price = ProvisioningPipeline.BOT_PRICE
         
-        # Check user balance
-        conn = sqlite3.connect(self.db.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT stars FROM users WHERE user_id = ?", (user_id,))
-        user = cursor.fetchone()
+        # Check user balance up front; the pipeline re-checks when reserving
+        conn = self.db.connect()
+        try:
+            user = conn.execute("SELECT stars FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        finally:
+            conn.close()
         
         if not user:
-            conn.close()
             self.send_message(chat_id, "❌ User not found. Send /start first.")
             return
         
         user_stars = user[0]
+        required = bot_price * len(bot_tokens)
         
-        if user_stars < bot_price:
-            conn.close()
+        if user_stars < required:
             self.send_message(chat_id,
                 f"❌ Insufficient stars\n"
-                f"Required: {bot_price} stars\n"
+                f"Required: {required} stars\n"
                 f"Your balance: {user_stars} stars\n\n"
                 f"Ask admin for stars: /addstars")
             return
         
-        # Test bot token
-        test_url = f"https://api.telegram.org/bot{bot_token}/getMe"
-        try:
-            response = requests.get(test_url, timeout=10)
-            if not response.json().get('ok'):
-                conn.close()
-                self.send_message(chat_id, "❌ Invalid bot token")
-                return
-            
-            bot_info = response.json()['result']
-            bot_username = bot_info['username']
-            
-        except:
-            conn.close()
-            self.send_message(chat_id, "❌ Could not verify bot token")
-            return
-        
-        # Create bot record
-        cursor.execute(
-            '''
-            INSERT INTO user_bots (bot_token, bot_username, owner_id)
-            VALUES (?, ?, ?)
-            ''',
-            (bot_token[:50], bot_username, user_id)
-        )
-        
-        # Deduct stars
-        cursor.execute(
-            "UPDATE users SET stars = stars - ? WHERE user_id = ?",
-            (bot_price, user_id)
-        )
-        
-        conn.commit()
-        conn.close()
-        
-        # Log activity
-        self.db.execute_with_backup(
-            "SELECT 1",  # Dummy query to trigger backup
-            user_id=user_id,
-            action="create_bot"
-        )
+        queued = []
+        for bot_token in bot_tokens:
+            job_id = self.provisioner.submit(user_id, chat_id, bot_token)
+            if job_id:
+                queued.append(job_id)
         
-        # Set webhook
-        webhook_url = f"{WEBHOOK_URL}/webhook/{bot_token}"
-        requests.post(
-            f"https://api.telegram.org/bot{bot_token}/setWebhook",
-            json={'url': webhook_url}
-        )
+        if not queued:
+            self.send_message(chat_id, "⏳ That bot is already being created.")
+            return
         
-        success_msg = f"""✅ *Bot Created Successfully!*
+        self.send_message(chat_id,
+            f"⏳ *Creating {len(queued)} bot{'s' if len(queued) > 1 else ''}...*\n\n"
+            f"Job{'s' if len(queued) > 1 else ''}: {', '.join(f'`{j}`' for j in queued)}\n"
+            f"You'll get a message as soon as {'each one is' if len(queued) > 1 else 'it is'} ready.")
+    
+    def bot_created_message(self, bot_username, bot_price, balance, webhook_url):
+        """Completion message for a provisioned bot"""
+        return f"""✅ *Bot Created Successfully!*
 
 🤖 Bot: @{bot_username}
 💰 Price: {bot_price} stars
-📉 New balance: {user_stars - bot_price} stars
+📉 New balance: {balance} stars
 
 🔗 Webhook: {webhook_url}
 
@@ -748,8 +3819,6 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
 🚀 Your bot is ready: @{bot_username}
 
 💾 *Auto-backup enabled!* All data will be saved to GitHub."""
-        
-        self.send_message(chat_id, success_msg)
     
     def handle_env(self, chat_id):
         """Handle /env command"""
@@ -773,7 +3842,7 @@ Hello {first_name}! I'm a bot factory with *automatic GitHub backups*.
 • Python: {sys.version.split()[0]}
 • SQLite: {sqlite3.sqlite_version}
 • Uptime: Running
-• Backups: {self.github_backup.backup_count} created
+• Backups: {self.backup_store.backup_count} created
 
 ✅ All systems operational!"""
         
@@ -796,9 +3865,19 @@ def health():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'backup_count': bot_instance.github_backup.backup_count if bot_instance else 0
+        'backup_count': bot_instance.backup_store.backup_count if bot_instance else 0,
+        'wal_shipping': bot_instance.wal_shipper.status() if bot_instance and bot_instance.wal_shipper else None,
+        'provisioning': bot_instance.provisioner.status() if bot_instance else None,
+        'shards': bot_instance.shards.status() if bot_instance else None,
+        'webhooks': bot_instance.webhook_monitor.status() if bot_instance else None,
+        'scheduler': bot_instance.scheduler.status() if bot_instance else None
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics endpoint"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/admin/backup', methods=['POST'])
 def admin_backup():
     """Admin backup endpoint"""
@@ -812,16 +3891,154 @@ def admin_backup():
     
     return jsonify({'error': 'Bot not initialized'}), 500
 
+@app.route('/admin/restore', methods=['POST'])
+def admin_restore():
+    """Point-in-time restore from WAL segments; returns the rebuilt database"""
+    auth = request.headers.get('Authorization')
+    if auth != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if not bot_instance or not bot_instance.wal_shipper:
+        return jsonify({'error': 'WAL shipping not enabled'}), 500
+    
+    target_time = None
+    at = request.args.get('at')
+    if at:
+        try:
+            target_time = datetime.fromisoformat(at)
+        except ValueError:
+            return jsonify({'error': 'Invalid timestamp, use ISO 8601'}), 400
+    
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(tmp_dir, 'restored.db')
+        try:
+            result = bot_instance.wal_shipper.restore(db_path, target_time)
+        except BackupStoreUnavailable as e:
+            return jsonify({'error': str(e)}), 503
+        if not result:
+            return jsonify({'error': 'No WAL generation found'}), 404
+        with open(db_path, 'rb') as f:
+            db_content = f.read()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    
+    return Response(db_content, mimetype='application/x-sqlite3', headers={
+        'Content-Disposition': f"attachment; filename=masterbot_{result['generation']}.db",
+        'X-Restored-To': result['restored_to'],
+        'X-Segments-Applied': str(result['segments'])
+    })
+
+@app.route('/admin/profile')
+def admin_profile():
+    """Sample all thread stacks for ?seconds= and return collapsed stacks"""
+    auth = request.headers.get('Authorization')
+    if auth != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.01))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    interval = min(max(interval, 0.001), 1.0)
+    
+    stacks = profiler.profile(seconds, interval)
+    if stacks is None:
+        return jsonify({'error': 'A profile is already running'}), 409
+    return Response(stacks, mimetype='text/plain')
+
+@app.route('/admin/traces')
+def admin_traces():
+    """Span traces of the slowest recent updates"""
+    auth = request.headers.get('Authorization')
+    if auth != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify({
+        'threshold_ms': round(tracer.threshold * 1000, 2),
+        'traces': tracer.slowest(limit)
+    })
+
+@app.route('/admin/export/<table>')
+def admin_export(table):
+    """Stream a table as NDJSON or CSV (keyset-paginated with ?after=&limit=)"""
+    auth = request.headers.get('Authorization')
+    if auth != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if not bot_instance:
+        return jsonify({'error': 'Bot not initialized'}), 500
+    if table not in BulkTransfer.TABLES:
+        return jsonify({'error': f"Unknown table, use one of: {', '.join(BulkTransfer.TABLES)}"}), 404
+    
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in BulkTransfer.FORMATS:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    
+    try:
+        after = BulkTransfer.decode_cursor(request.args['after']) if request.args.get('after') else None
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    headers = {'Content-Disposition': f"attachment; filename={table}.{fmt}"}
+    if limit is not None:
+        next_cursor, rows = bot_instance.bulk.export_page(table, fmt, after, limit)
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+    else:
+        rows = bot_instance.bulk.export_rows(table, fmt)
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
+
+@app.route('/admin/import/<table>', methods=['POST'])
+def admin_import(table):
+    """Upsert rows streamed as NDJSON or CSV in batched transactions"""
+    auth = request.headers.get('Authorization')
+    if auth != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if not bot_instance:
+        return jsonify({'error': 'Bot not initialized'}), 500
+    if table not in BulkTransfer.TABLES:
+        return jsonify({'error': f"Unknown table, use one of: {', '.join(BulkTransfer.TABLES)}"}), 404
+    
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in BulkTransfer.FORMATS:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    
+    result = bot_instance.bulk.import_rows(table, request.stream, fmt)
+    return jsonify(result), 400 if 'error' in result else 200
+
 @app.route('/webhook/<bot_token>', methods=['POST'])
 def webhook(bot_token):
     """Handle Telegram webhook"""
     try:
         if bot_token == BOT_TOKEN and bot_instance:
+            received_at = time.perf_counter()
             update = request.get_json()
             # Process in background thread
             threading.Thread(
                 target=bot_instance.process_update,
-                args=(update,),
+                args=(update, received_at),
+                daemon=True
+            ).start()
+            return 'ok', 200
+        if bot_instance and bot_instance.is_hosted_bot(bot_token):
+            received_at = time.perf_counter()
+            update = request.get_json()
+            threading.Thread(
+                target=bot_instance.process_child_update,
+                args=(bot_token, update, received_at),
                 daemon=True
             ).start()
             return 'ok', 200
@@ -868,6 +4085,10 @@ def start_bot():
 # ==================== MAIN ====================
 
 if __name__ == "__main__":
+    # Exit normally on SIGTERM (Render restarts and deploys) so the atexit
+    # shutdown flushes WAL frames and dirty shards
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     # Start bot
     bot = start_bot()
     
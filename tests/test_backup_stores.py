@@ -0,0 +1,113 @@
+"""Backup store behaviour against the benchmark's fake GitHub and S3
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+# Config is read at import time
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ['BACKUP_STORE'] = 'local'
+os.environ['WAL_SHIP_INTERVAL'] = '5'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import FakeGitHub, FakeS3  # noqa: E402
+from master_bot import DatabaseManager, GitHubAutoBackup, LocalDirectoryStore, S3Store  # noqa: E402
+
+
+class StoreTestCase(unittest.TestCase):
+    """Runs each test against a local directory, fake GitHub and fake S3"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.github = FakeGitHub().start()
+        self.s3 = FakeS3().start()
+
+    def tearDown(self):
+        self.github.stop()
+        self.s3.stop()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def stores(self):
+        github = GitHubAutoBackup()
+        github.repo_url = f"{self.github.url}/repos/test/backups"
+        s3 = S3Store()
+        s3.endpoint, s3.host, s3.bucket = self.s3.url, self.s3.url.split('//', 1)[1], 'test'
+        return [LocalDirectoryStore('store'), github, s3]
+
+
+class LeaseTest(StoreTestCase):
+
+    def test_one_owner_at_a_time(self):
+        for store in self.stores():
+            with self.subTest(store=store.name):
+                self.assertTrue(store.acquire_lease('sweep', 'a', 60))
+                self.assertFalse(store.acquire_lease('sweep', 'b', 60))
+                self.assertTrue(store.acquire_lease('sweep', 'a', 60))
+
+    def test_expired_lease_is_taken_over(self):
+        for store in self.stores():
+            with self.subTest(store=store.name):
+                self.assertTrue(store.acquire_lease('sweep', 'a', -1))
+                self.assertTrue(store.acquire_lease('sweep', 'b', 60))
+                self.assertFalse(store.acquire_lease('sweep', 'a', 60))
+
+    def test_conditional_write_has_one_winner(self):
+        for store in self.stores():
+            with self.subTest(store=store.name):
+                self.assertTrue(store.put_if_version('leases/x.json', b'0', None))
+                self.assertFalse(store.put_if_version('leases/x.json', b'1', None))
+                _, version = store.get_versioned('leases/x.json')
+                self.assertTrue(store.put_if_version('leases/x.json', b'2', version))
+                self.assertFalse(store.put_if_version('leases/x.json', b'3', version))
+                self.assertEqual(store.get_versioned('leases/x.json')[0], b'2')
+
+
+class OverwriteTest(StoreTestCase):
+
+    def test_big_small_big_restores_the_latest(self):
+        big, small, smaller_big = os.urandom(5000), b'small', os.urandom(2500)
+        for store in self.stores():
+            store.chunk_size = 1024
+            with self.subTest(store=store.name):
+                for content in (big, small, smaller_big, small):
+                    self.assertTrue(store.put_objects({'shards/1.db': content}))
+                    self.assertEqual(store.get_large('shards/1.db'), content)
+
+    def test_no_stale_layout_files_are_left(self):
+        store = self.stores()[1]
+        store.chunk_size = 1024
+        self.assertTrue(store.put_large('shards/1.db', os.urandom(5000)))
+        self.assertTrue(store.put_large('shards/1.db', os.urandom(2500)))
+        self.assertEqual(store.list_objects('shards/1.db.parts'), ['00000', '00001', '00002'])
+        self.assertEqual(sorted(store.list_objects('shards')), ['1.db.manifest', '1.db.parts'])
+        self.assertTrue(store.put_objects({'shards/1.db': b'small'}))
+        self.assertEqual(store.list_objects('shards'), ['1.db'])
+
+
+class DatabaseLockTest(unittest.TestCase):
+
+    def test_second_process_is_refused(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                store = LocalDirectoryStore('store')
+                db = DatabaseManager(store)
+                with self.assertRaises(RuntimeError):
+                    DatabaseManager(store)
+                db.lock_file.close()
+                DatabaseManager(store).lock_file.close()
+            finally:
+                os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Bulk import error reporting
+
+Run with: python -m unittest discover -s tests
+"""
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+# Config is read at import time
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ['BACKUP_STORE'] = 'local'
+os.environ['WAL_SHIP_INTERVAL'] = '5'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from master_bot import BulkTransfer, DatabaseManager, LocalDirectoryStore  # noqa: E402
+
+
+class ImportErrorTest(unittest.TestCase):
+
+    def setUp(self):
+        # DatabaseManager keeps masterbot.db in the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.db = DatabaseManager(LocalDirectoryStore('store'))
+        self.bulk = BulkTransfer(self.db)
+        self.bulk.import_batch_size = 2
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def import_lines(self, lines, fmt='ndjson'):
+        return self.bulk.import_rows('users', io.BytesIO("\n".join(lines).encode('utf-8')), fmt)
+
+    def user_ids(self):
+        conn = self.db.connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+        finally:
+            conn.close()
+
+    def assertFailsAt(self, result, line, imported):
+        self.assertEqual(result['line'], line, result)
+        self.assertTrue(result['error'].startswith(f"Line {line}: "), result)
+        self.assertEqual(result['imported'], imported)
+
+    def test_nested_value_reports_its_line(self):
+        result = self.import_lines([
+            '{"user_id": 1, "username": "a"}',
+            '{"user_id": 2, "username": "b"}',
+            '{"user_id": 3, "username": "c"}',
+            '{"user_id": 4, "username": {"a": 1}}',
+        ])
+        self.assertFailsAt(result, 4, 2)
+        self.assertEqual(self.user_ids(), [1, 2])
+
+    def test_null_key_is_rejected(self):
+        result = self.import_lines(['{"user_id": 1}', '{"user_id": null}'])
+        self.assertFailsAt(result, 2, 0)
+        self.assertEqual(self.user_ids(), [])
+
+    def test_malformed_csv_reports_its_line(self):
+        result = self.import_lines(['user_id,username', '1,a', '2,"b"c'], fmt='csv')
+        self.assertFailsAt(result, 3, 0)
+        self.assertIn('invalid CSV', result['error'])
+
+    def test_csv_row_with_extra_fields(self):
+        result = self.import_lines(['user_id,username', '1,a', '2,b,c'], fmt='csv')
+        self.assertFailsAt(result, 3, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""SQLite statement metrics and trace spans for connection-level calls
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+# Config is read at import time
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ['BACKUP_STORE'] = 'local'
+os.environ['WAL_SHIP_INTERVAL'] = '5'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from master_bot import LocalDirectoryStore, MasterBot, ShardManager, metrics, tracer  # noqa: E402
+
+
+def statement_count(op):
+    hist = metrics.histograms.get(metrics._key('sqlite_statement_seconds', {'op': op}))
+    return hist['count'] if hist else 0
+
+
+class ShardInstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        # SHARD_DIR and the store are relative to the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.shards = ShardManager(LocalDirectoryStore('store'))
+
+    def tearDown(self):
+        self.shards.close_all()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_connection_execute_is_timed(self):
+        inserts, selects, many = statement_count('INSERT'), statement_count('SELECT'), statement_count('INSERT_MANY')
+        with self.shards.connection('42', write=True) as conn:
+            conn.execute("INSERT INTO bot_users (user_id, username) VALUES (?, ?)", (1, 'a'))
+            conn.executemany("INSERT INTO bot_events (user_id, kind) VALUES (?, ?)", [(1, 'x'), (1, 'y')])
+            conn.execute("SELECT COUNT(*) FROM bot_users").fetchone()
+            conn.commit()
+        self.assertEqual(statement_count('INSERT'), inserts + 1)
+        self.assertEqual(statement_count('INSERT_MANY'), many + 1)
+        self.assertEqual(statement_count('SELECT'), selects + 1)
+
+    def test_child_update_trace_has_db_spans(self):
+        threshold = tracer.threshold
+        tracer.threshold = 0
+        try:
+            # Only the shard manager is needed for a message without a reply
+            bot = SimpleNamespace(shards=self.shards)
+            update = {'message': {'chat': {'id': 7}, 'from': {'id': 7, 'first_name': 'A'}, 'text': 'hello'}}
+            MasterBot.process_child_update(bot, '42:token', update)
+        finally:
+            tracer.threshold = threshold
+
+        trace = next(t for t in tracer.traces if t['name'] == 'process_child_update')
+        self.assertNotIn('error', trace['attrs'])
+        db_spans = [span['name'] for span in trace['spans'] if span['kind'] == 'db']
+        self.assertEqual(db_spans.count('INSERT'), 2)
+        self.assertIn('COMMIT', db_spans)
+        self.assertIn('db', trace['span_totals_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
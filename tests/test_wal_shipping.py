@@ -0,0 +1,150 @@
+"""Round trip of WAL shipping against a local directory store
+
+Run with: python -m unittest discover -s tests
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+# Config is read at import time
+os.environ.setdefault('BOT_TOKEN', '123456:test')
+os.environ['BACKUP_STORE'] = 'local'
+os.environ['WAL_SHIP_INTERVAL'] = '5'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from master_bot import BackupStoreUnavailable, DatabaseManager, LocalDirectoryStore, WALShipper  # noqa: E402
+
+
+class WALShippingTest(unittest.TestCase):
+
+    def setUp(self):
+        # DatabaseManager keeps masterbot.db in the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.store = LocalDirectoryStore('store')
+        self.db = DatabaseManager(self.store)
+        self.shipper = WALShipper(self.db, self.store)
+        # Small enough that the shipper checkpoints and the WAL restarts
+        self.shipper.checkpoint_bytes = 16 * 1024
+        self.shipper.start()
+
+    def tearDown(self):
+        self.shipper.conn.close()
+        self.shipper.checkpoint_conn.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def write(self, first, count):
+        conn = self.db.connect()
+        try:
+            conn.executemany(
+                "INSERT INTO activity_logs (user_id, action, details) VALUES (?, 'test', ?)",
+                [(user_id, 'x' * 1000) for user_id in range(first, first + count)]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def rows(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], 'ok')
+            return [row[0] for row in conn.execute("SELECT user_id FROM activity_logs ORDER BY id")]
+        finally:
+            conn.close()
+
+    def segments(self):
+        return sorted(n for n in self.store.list_objects(f"wal/{self.shipper.generation}") if n.endswith('.seg'))
+
+    def test_restore_latest_across_checkpoints(self):
+        salts = set()
+        for batch in range(10):
+            self.write(batch * 10, 10)
+            self.assertTrue(self.shipper.ship())
+            salts.add(self.shipper.salt)
+        self.assertGreater(len(salts), 1, "the WAL never restarted after a checkpoint")
+
+        result = self.shipper.restore('restored.db')
+        self.assertEqual(result['segments'], 10)
+        self.assertEqual(self.rows('restored.db'), self.rows('masterbot.db'))
+        self.assertEqual(len(self.rows('restored.db')), 100)
+
+    def test_point_in_time_restore(self):
+        self.write(0, 5)
+        self.assertTrue(self.shipper.ship())
+        time.sleep(0.01)
+        mark = datetime.now()
+        time.sleep(0.01)
+        self.write(5, 5)
+        self.assertTrue(self.shipper.ship())
+
+        self.shipper.restore('at_mark.db', mark)
+        self.assertEqual(self.rows('at_mark.db'), list(range(5)))
+        self.shipper.restore('latest.db')
+        self.assertEqual(self.rows('latest.db'), list(range(10)))
+
+    def test_restore_from_newer_generation(self):
+        self.write(0, 5)
+        self.assertTrue(self.shipper.ship())
+        time.sleep(0.01)
+        self.assertTrue(self.shipper.snapshot())
+        self.write(5, 5)
+        self.assertTrue(self.shipper.ship())
+
+        result = self.shipper.restore('restored.db')
+        self.assertEqual(result['generation'], self.shipper.generation)
+        self.assertEqual(self.rows('restored.db'), list(range(10)))
+
+    def test_snapshot_copy_does_not_block_writers(self):
+        self.write(0, 5)
+        snapshot_bytes = self.db.snapshot_bytes
+
+        def copy_during_write(source=None):
+            conn = self.db.connect()
+            try:
+                conn.execute("PRAGMA busy_timeout=0")
+                conn.execute("INSERT INTO activity_logs (user_id, action) VALUES (5, 'during copy')")
+                conn.commit()
+            finally:
+                conn.close()
+            return snapshot_bytes(source)
+
+        self.db.snapshot_bytes = copy_during_write
+        self.assertTrue(self.shipper.snapshot())
+        self.db.snapshot_bytes = snapshot_bytes
+        self.assertTrue(self.shipper.ship())
+
+        result = self.shipper.restore('restored.db')
+        self.assertEqual(result['segments'], 1)
+        self.assertEqual(self.rows('restored.db'), list(range(6)))
+
+    def test_failed_uploads_are_coalesced(self):
+        put_object = self.store.put_object
+        self.store.put_object = lambda name, content, message=None: False
+        for batch in range(3):
+            self.write(batch * 5, 5)
+            self.assertFalse(self.shipper.ship())
+        self.store.put_object = put_object
+        self.write(15, 5)
+        self.assertTrue(self.shipper.ship())
+
+        self.assertEqual(len(self.segments()), 1)
+        self.shipper.restore('restored.db')
+        self.assertEqual(self.rows('restored.db'), list(range(20)))
+
+    def test_unreachable_store_raises(self):
+        self.store.list_objects = lambda prefix: None
+        with self.assertRaises(BackupStoreUnavailable):
+            self.shipper.restore('restored.db')
+        self.assertFalse(os.path.exists('restored.db'))
+
+
+if __name__ == '__main__':
+    unittest.main()